@@ -0,0 +1,96 @@
+"""
+Concurrency stress test for the inventory UPDATEs used by reserve_book.
+
+    python bench_inventory.py                           # SQLite scratch file
+    python bench_inventory.py --db postgresql://... --workers 64 --requests 500 --copies 100
+
+Fires --requests parallel reservations at one book with --copies copies and checks that
+exactly --copies succeed and copies_available never goes negative. Needs only SQLAlchemy;
+it creates its own `book` table, so point --db at a scratch database.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlalchemy.exc import OperationalError
+
+import inventory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--copies', type=int, default=100)
+    args = parser.parse_args()
+
+    db_url = args.db or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_inventory.db')
+    connect_args = {'timeout': 30} if db_url.startswith('sqlite') else {}
+    engine = create_engine(db_url, pool_size=args.workers, connect_args=connect_args)
+    meta = MetaData()
+    book = Table('book', meta,
+                 Column('book_id', Integer, primary_key=True),
+                 Column('isbn', String(32), nullable=False),
+                 Column('copies_total', Integer),
+                 Column('copies_available', Integer))
+    meta.drop_all(engine)
+    meta.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(book.insert().values(book_id=1, isbn='stress', copies_total=args.copies,
+                                          copies_available=args.copies))
+
+    lock = threading.Lock()
+    outcome = {'ok': 0, 'rejected': 0, 'retried': 0, 'negative': 0}
+
+    def reserve(_):
+        while True:
+            try:
+                with engine.begin() as conn:
+                    counts = inventory.take_copies(conn, book, 1)
+                break
+            except OperationalError:
+                # SQLite "database is locked"; a real server just queues on the row lock
+                with lock:
+                    outcome['retried'] += 1
+        with lock:
+            if counts is None:
+                outcome['rejected'] += 1
+            else:
+                outcome['ok'] += 1
+                if counts.copies_available < 0:
+                    outcome['negative'] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(reserve, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as conn:
+        final = conn.execute(select(book.c.copies_available).where(book.c.book_id == 1)).scalar()
+    meta.drop_all(engine)
+
+    print(f'{args.requests} reservations, {args.workers} workers, {args.copies} copies')
+    print(f"  succeeded {outcome['ok']}, rejected {outcome['rejected']}, lock retries {outcome['retried']}")
+    print(f'  {elapsed:.2f}s, {args.requests / elapsed:,.0f} reservations/sec, final copies_available={final}')
+
+    expected_ok = min(args.copies, args.requests)
+    failures = []
+    if outcome['ok'] != expected_ok:
+        failures.append(f"expected {expected_ok} successful reservations, got {outcome['ok']}")
+    if outcome['negative'] or final < 0:
+        failures.append('copies_available went negative')
+    if final != args.copies - expected_ok:
+        failures.append(f'final copies_available {final} != {args.copies - expected_ok}')
+    for f in failures:
+        print('FAIL: ' + f)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Compare /books?q= latency: the old leading-wildcard ILIKE query vs the in-process SearchIndex.
+
+    python bench_search.py                     # 10k, 100k and 1M books on in-memory SQLite
+    python bench_search.py --sizes 10000 --db postgresql://...
+
+Only needs SQLAlchemy; it builds its own `book` table and never touches the app database
+unless --db points at one (use a scratch database).
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import (Column, Integer, MetaData, String, Table, create_engine,
+                        func, or_, select)
+
+from search_index import SearchIndex
+
+WORDS = ('history modern data python garden ocean river silent empire quantum art '
+         'music biology law africa economics design stars winter mountain code '
+         'theory practice introduction advanced guide complete learning world').split()
+NAMES = ('Smith Nkosi Dlamini Mokoena Brown Naidoo Khumalo Botha Jones Mahlangu '
+         'Pillay Ndlovu Williams Zulu Taylor Mabaso Sithole Wilson Mthembu Davis').split()
+QUERIES = ['python', 'pyth', 'modern history', 'Nkosi', 'quantum theory', '978-0-0000012', 'zzz']
+
+
+def make_rows(n, rnd):
+    for i in range(1, n + 1):
+        title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 5))).title() + f' {i}'
+        author = f'{rnd.choice(NAMES)} {rnd.choice(NAMES)}'
+        yield {'book_id': i, 'isbn': f'978-0-{i:09d}', 'title': title, 'author': author}
+
+
+def ilike_search(conn, book, term, per_page=10):
+    cond = or_(book.c.isbn.ilike(f'%{term}%'),
+               book.c.title.ilike(f'%{term}%'),
+               book.c.author.ilike(f'%{term}%'))
+    # paginate() issues both a page query and a COUNT(*)
+    conn.execute(select(book).where(cond).limit(per_page)).fetchall()
+    conn.execute(select(func.count()).select_from(book).where(cond)).scalar()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def run(size, db_url, repeat):
+    rnd = random.Random(size)
+    engine = create_engine(db_url)
+    meta = MetaData()
+    book = Table('book', meta,
+                 Column('book_id', Integer, primary_key=True),
+                 Column('isbn', String(32), unique=True, nullable=False),
+                 Column('title', String(512), nullable=False),
+                 Column('author', String(256), nullable=False))
+    meta.drop_all(engine)
+    meta.create_all(engine)
+
+    with engine.begin() as conn:
+        batch = []
+        for row in make_rows(size, rnd):
+            batch.append(row)
+            if len(batch) == 10000:
+                conn.execute(book.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(book.insert(), batch)
+
+    index = SearchIndex()
+    with engine.connect() as conn:
+        t0 = time.perf_counter()
+        index.rebuild(conn.execute(select(book.c.book_id, book.c.isbn, book.c.title, book.c.author)))
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        print(f'\n{size:,} books (index build {build_ms:,.0f} ms)')
+        print(f'  {"query":<16}{"ILIKE ms":>12}{"index ms":>12}{"hits":>10}')
+        for q in QUERIES:
+            ilike_ms = timed(lambda: ilike_search(conn, book, q), repeat)
+            index_ms = timed(lambda: index.search(q)[:10], repeat)
+            print(f'  {q:<16}{ilike_ms:>12.2f}{index_ms:>12.2f}{len(index.search(q)):>10,}')
+    meta.drop_all(engine)
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--db', default='sqlite://')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for n in (int(x) for x in args.sizes.split(',')):
+        run(n, args.db, args.repeat)
@@ -0,0 +1,73 @@
+"""
+Memory footprint and query speed of the in-memory seat map.
+
+    python bench_seat_map.py [--seats 100000] [--room-size 100] [--libraries 10]
+
+Builds a SeatMap from synthetic seat rows (no database needed) and reports the
+traced allocation size, per-seat bytes and timings for free counts, availability
+listings and write-through updates.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from seat_map import SeatMap
+
+
+def make_rows(n, room_size, libraries, rnd):
+    for i in range(n):
+        room_id = i // room_size + 1
+        yield {
+            'seat_id': i + 1,
+            'identifier': f'S{i % room_size + 1}',
+            'is_computer': rnd.random() < 0.3,
+            'is_active': rnd.random() < 0.9,
+            'is_occupied': rnd.random() < 0.5,
+            'room_id': room_id,
+            'specs': 'Standard specs',
+            'library_id': room_id % libraries + 1,
+        }
+
+
+def timed(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{label:<34} {elapsed * 1e6:10.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seats', type=int, default=100000)
+    parser.add_argument('--room-size', type=int, default=100)
+    parser.add_argument('--libraries', type=int, default=10)
+    args = parser.parse_args()
+    rnd = random.Random(42)
+    rows = list(make_rows(args.seats, args.room_size, args.libraries, rnd))
+
+    seat_map = SeatMap()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    seat_map.load(rows)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print(f'{len(seat_map)} seats in {args.seats // args.room_size} rooms, {args.libraries} libraries')
+    print(f'map footprint: {size / 1024 / 1024:.2f} MiB ({size / len(seat_map):.0f} bytes/seat)')
+
+    timed('free_count(library)', lambda: seat_map.free_count(1), 200)
+    timed('free_count(room, computers)', lambda: seat_map.free_count(2, room_id=1, is_computer=True), 10000)
+    timed('seats(room)', lambda: seat_map.seats(2, room_id=1), 2000)
+    timed('seats(library, active)', lambda: seat_map.seats(1), 20)
+
+    updates = [dict(rows[rnd.randrange(len(rows))], is_occupied=rnd.random() < 0.5) for _ in range(10000)]
+    start = time.perf_counter()
+    for row in updates:
+        seat_map.put(row['library_id'], row)
+    print(f'{"put (write-through)":<34} {(time.perf_counter() - start) / len(updates) * 1e6:10.1f} us')
+
+
+if __name__ == '__main__':
+    main()
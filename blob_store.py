@@ -0,0 +1,58 @@
+import hashlib
+import os
+import re
+import tempfile
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# (magic prefix, offset, mimetype)
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 0, 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'image/png'),
+    (b'GIF8', 0, 'image/gif'),
+    (b'WEBP', 8, 'image/webp'),
+)
+
+
+def sniff_mimetype(head):
+    for magic, offset, mimetype in _SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mimetype
+    return 'application/octet-stream'
+
+
+class BlobStore:
+    """
+    Content-addressed files on local disk: a blob is stored under the sha256 of its bytes,
+    sharded by the first two hex characters, so identical covers are stored once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def is_valid_hash(digest):
+        return bool(digest) and bool(_HASH_RE.match(digest))
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def exists(self, digest):
+        return self.is_valid_hash(digest) and os.path.exists(self.path_for(digest))
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write-then-rename so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def mimetype(self, digest):
+        with open(self.path_for(digest), 'rb') as f:
+            return sniff_mimetype(f.read(16))
@@ -0,0 +1,215 @@
+import csv
+import io
+import json
+import os
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+COVER_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(filename=None, content_type=None):
+    name = (filename or '').lower()
+    ctype = (content_type or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in ctype or 'jsonl' in ctype:
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_records(stream, fmt):
+    """Yield (line_no, dict) from a binary stream without reading it all into memory."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, ValueError(f'Invalid JSON: {e}')
+                continue
+            yield line_no, record if isinstance(record, dict) else ValueError('Each line must be a JSON object')
+    else:
+        reader = csv.DictReader(text)
+        for record in reader:
+            # line_num points at the last physical line of the record (header is line 1)
+            yield reader.line_num, record
+
+
+def clean_record(record):
+    """Validate one import row with the same rules as add_book; raises ValueError."""
+    if isinstance(record, Exception):
+        raise record
+
+    def text(key):
+        value = record.get(key)
+        return str(value).strip() if value is not None else ''
+
+    isbn, title, author = text('isbn'), text('title'), text('author')
+    if not isbn:
+        raise ValueError('ISBN is required')
+    if not title:
+        raise ValueError('Title is required')
+    if not author:
+        raise ValueError('Author is required')
+
+    year = text('year')
+    if year and not year.isdigit():
+        raise ValueError('Year must be an integer')
+    copies = text('copies_total') or '1'
+    if not copies.isdigit() or int(copies) < 1:
+        raise ValueError('copies_total must be a positive integer')
+
+    return {
+        'isbn':             isbn,
+        'title':            title,
+        'author':           author,
+        'publisher':        text('publisher') or None,
+        'year':             int(year) if year else None,
+        'copies_total':     int(copies),
+        'copies_available': int(copies),
+        'cover':            text('cover') or None,
+    }
+
+
+class BookImporter:
+    """
+    Upserts books by ISBN in multi-row INSERT ... ON CONFLICT batches.
+    Covers are taken from `covers_dir`, either the row's `cover` filename or <isbn>.<ext>.
+    """
+
+    def __init__(self, session, table, cover_store, covers_dir=None, batch_size=1000, progress=None):
+        self.session = session
+        self.table = table
+        self.cover_store = cover_store
+        self.covers_dir = covers_dir
+        self.batch_size = batch_size
+        self.progress = progress
+        self.dialect = session.get_bind().dialect.name
+        self.processed = 0
+        self.upserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def run(self, records):
+        started = time.perf_counter()
+        batch = {}
+        for line_no, record in records:
+            self.processed += 1
+            try:
+                row = clean_record(record)
+                row['cover_hash'] = self._cover_hash(row.pop('cover'), row['isbn'])
+            except (ValueError, OSError) as e:
+                self._error(line_no, e)
+                continue
+            # A repeated ISBN within one batch would hit the same row twice in one statement;
+            # the later line wins, as it would across batches, and the earlier one is reported
+            earlier = batch.pop(row['isbn'], None)
+            if earlier is not None:
+                self._error(earlier[0], ValueError(f"Duplicate ISBN {row['isbn']}: superseded by line {line_no}"))
+            batch[row['isbn']] = (line_no, row)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = {}
+                if self.progress:
+                    self.progress(self.report(started))
+        if batch:
+            self._flush(batch)
+        return self.report(started)
+
+    def report(self, started):
+        elapsed = time.perf_counter() - started
+        return {
+            'processed':    self.processed,
+            'upserted':     self.upserted,
+            'failed':       self.error_count,
+            'errors':       self.errors,
+            'elapsed_s':    round(elapsed, 3),
+            'rows_per_sec': round(self.processed / elapsed, 1) if elapsed else None
+        }
+
+    def _flush(self, batch):
+        rows = [row for _, row in batch.values()]
+        try:
+            self.session.execute(self._upsert(rows))
+            self.session.commit()
+            self.upserted += len(rows)
+            return
+        except SQLAlchemyError:
+            self.session.rollback()
+        # Retry row by row so one bad row doesn't sink the whole batch
+        for line_no, row in batch.values():
+            try:
+                self.session.execute(self._upsert([row]))
+                self.session.commit()
+                self.upserted += 1
+            except SQLAlchemyError as e:
+                self.session.rollback()
+                self._error(line_no, getattr(e, 'orig', None) or e)
+
+    def _available(self, new_total):
+        # Copies on loan stay on loan when the total shrinks; availability bottoms out at 0
+        t = self.table
+        available = t.c.copies_available + new_total - t.c.copies_total
+        if self.dialect == 'sqlite':
+            return func.max(available, 0)
+        return func.greatest(available, 0)
+
+    def _upsert(self, rows):
+        t = self.table
+        if self.dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(t).values(rows)
+            new = stmt.inserted
+            # MySQL applies assignments left to right, so adjust availability before the total
+            return stmt.on_duplicate_key_update([
+                ('copies_available', self._available(new.copies_total)),
+                ('copies_total',     new.copies_total),
+                ('title',            new.title),
+                ('author',           new.author),
+                ('publisher',        new.publisher),
+                ('year',             new.year),
+                ('cover_hash',       func.coalesce(new.cover_hash, t.c.cover_hash)),
+            ])
+        if self.dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(t).values(rows)
+        new = stmt.excluded
+        return stmt.on_conflict_do_update(
+            index_elements=[t.c.isbn],
+            set_={
+                'copies_available': self._available(new.copies_total),
+                'copies_total':     new.copies_total,
+                'title':            new.title,
+                'author':           new.author,
+                'publisher':        new.publisher,
+                'year':             new.year,
+                'cover_hash':       func.coalesce(new.cover_hash, t.c.cover_hash),
+            }
+        )
+
+    def _cover_hash(self, cover, isbn):
+        if not self.covers_dir:
+            return None
+        if cover:
+            path = os.path.join(self.covers_dir, os.path.basename(cover))
+            if not os.path.isfile(path):
+                raise ValueError(f'Cover file not found: {cover}')
+            candidates = [path]
+        else:
+            candidates = [os.path.join(self.covers_dir, isbn + ext) for ext in COVER_EXTENSIONS]
+        for path in candidates:
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    return self.cover_store.put(f.read())
+        return None
+
+    def _error(self, line_no, exc):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'error': str(exc)})
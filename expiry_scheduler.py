@@ -0,0 +1,125 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+log = logging.getLogger(__name__)
+
+
+def as_naive_utc(dt):
+    # DB timestamps are naive UTC; reserve_book may hand us aware datetimes
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+class ExpiryScheduler:
+    """
+    Background thread that keeps upcoming expiries in a min-heap and hands due keys
+    to `expire_batch(keys)` in groups of at most `batch_size`.
+
+    Only the next `horizon` is held in memory. The heap is rebuilt from
+    `load_upcoming(until)` -> [(key, expires_at)] on start and every horizon/2, so a
+    restart (or writes from another worker) is picked up without extra bookkeeping.
+    Callbacks run on the scheduler thread and must set up their own app context.
+    """
+
+    def __init__(self, expire_batch, load_upcoming, batch_size=500, horizon=timedelta(hours=1),
+                 clock=datetime.utcnow):
+        self.expire_batch = expire_batch
+        self.load_upcoming = load_upcoming
+        self.batch_size = batch_size
+        self.horizon = horizon
+        self.clock = clock
+        self.expired = 0
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._next_refresh = None
+        self._loading = None    # schedule() calls made while _refresh is reading the DB
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, key, expires_at):
+        expires_at = as_naive_utc(expires_at)
+        with self._cond:
+            # Not running (disabled or not started yet): start() loads everything anyway
+            if self._thread is None:
+                return
+            # Anything past the loaded window is picked up by the next refresh
+            if self._next_refresh is not None and expires_at > self._next_refresh + self.horizon:
+                return
+            if self._loading is not None:
+                self._loading.append((expires_at, key))
+            heapq.heappush(self._heap, (expires_at, key))
+            if self._heap[0][1] == key:
+                self._cond.notify()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refresh(self, now):
+        with self._cond:
+            self._loading = []
+        try:
+            rows = self.load_upcoming(now + self.horizon)
+        except Exception:
+            with self._cond:
+                self._loading = None
+            raise
+        heap = [(as_naive_utc(when), key) for key, when in rows]
+        with self._cond:
+            # Keep what was scheduled during the load; it may have committed after our read
+            heap.extend(self._loading)
+            self._loading = None
+            heapq.heapify(heap)
+            self._heap = heap
+            self._next_refresh = now + self.horizon / 2
+
+    def _pop_due(self, now):
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+            now = self.clock()
+            try:
+                if self._next_refresh is None or now >= self._next_refresh:
+                    self._refresh(now)
+                due = self._pop_due(now)
+                if due:
+                    self.expired += self.expire_batch(due) or 0
+                    continue
+            except Exception:
+                # Failed keys are still active in the DB, the next refresh reloads them
+                log.exception('Expiry batch failed')
+                self._next_refresh = now + timedelta(seconds=30)
+
+            with self._cond:
+                if self._stopped:
+                    return
+                wake = self._next_refresh
+                if self._heap and self._heap[0][0] < wake:
+                    wake = self._heap[0][0]
+                self._cond.wait(max((wake - self.clock()).total_seconds(), 0.05))
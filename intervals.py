@@ -0,0 +1,91 @@
+"""
+Sorted sets of disjoint half-open [start, end) intervals.
+
+Used to intersect librarians' appointments with library opening hours: overlap and
+containment tests are a bisect, and subtract() walks both sets once.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+class IntervalSet:
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        for start, end in sorted(intervals):
+            self.add(start, end)
+
+    def __iter__(self):
+        return iter(zip(self._starts, self._ends))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __bool__(self):
+        return bool(self._starts)
+
+    def add(self, start, end):
+        """Insert [start, end), merging with anything it overlaps or touches."""
+        if end <= start:
+            return
+        i = bisect_left(self._ends, start)
+        j = bisect_right(self._starts, end)
+        if i < j:
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def overlaps(self, start, end):
+        i = bisect_right(self._starts, start) - 1
+        if i >= 0 and self._ends[i] > start:
+            return True
+        return i + 1 < len(self._starts) and self._starts[i + 1] < end
+
+    def contains(self, start, end):
+        """True if [start, end) lies inside a single interval."""
+        i = bisect_right(self._starts, start) - 1
+        return i >= 0 and self._ends[i] >= end
+
+    def subtract(self, other):
+        out = IntervalSet()
+        busy = list(other)
+        k = 0
+        for start, end in self:
+            while k < len(busy) and busy[k][1] <= start:
+                k += 1
+            cur, j = start, k
+            while j < len(busy) and busy[j][0] < end:
+                if busy[j][0] > cur:
+                    out._starts.append(cur)
+                    out._ends.append(busy[j][0])
+                cur = max(cur, busy[j][1])
+                j += 1
+            if cur < end:
+                out._starts.append(cur)
+                out._ends.append(end)
+        return out
+
+    def clip(self, start, end):
+        return self.subtract(IntervalSet([(datetime.min, start), (end, datetime.max)]))
+
+
+def opening_intervals(hours, first, last):
+    """
+    Opening hours for the dates first..last as an IntervalSet. `hours` maps a weekday
+    name ('Mon'..'Sun') to [(open_time, close_time)]; a close at or before the open
+    means the library closes after midnight.
+    """
+    out = IntervalSet()
+    day = first
+    while day <= last:
+        for open_t, close_t in hours.get(WEEKDAYS[day.weekday()], ()):
+            start = datetime.combine(day, open_t)
+            end = datetime.combine(day, close_t)
+            if end <= start:
+                end += timedelta(days=1)
+            out.add(start, end)
+        day += timedelta(days=1)
+    return out
@@ -0,0 +1,124 @@
+"""
+Inventory changes as single conditional UPDATE statements.
+
+Each helper runs in the caller's transaction and returns the book's
+(copies_total, copies_available) after the change, or None when the
+guard failed (no such book, nothing available, ...).  There is no
+read-then-write round trip, so concurrent reservations cannot overbook.
+"""
+from sqlalchemy import case, select, update
+
+
+def _dialect(bind):
+    return bind.dialect if hasattr(bind, 'dialect') else bind.get_bind().dialect
+
+
+def _apply(bind, book, book_id, stmt):
+    cols = (book.c.copies_total, book.c.copies_available)
+    if _dialect(bind).update_returning:
+        return bind.execute(stmt.returning(*cols)).first()
+    # MySQL: the UPDATE has row-locked the book, so a follow-up read in the same transaction is consistent
+    if bind.execute(stmt).rowcount != 1:
+        return None
+    return bind.execute(select(*cols).where(book.c.book_id == book_id)).first()
+
+
+def take_copies(bind, book, book_id, n=1):
+    """Reserve/check out n copies if at least n are available."""
+    stmt = (
+        update(book)
+        .where(book.c.book_id == book_id, book.c.copies_available >= n)
+        .values(copies_available=book.c.copies_available - n)
+    )
+    return _apply(bind, book, book_id, stmt)
+
+
+def release_copies(bind, book, book_id, n=1):
+    """Give n copies back, never exceeding copies_total."""
+    restored = book.c.copies_available + n
+    stmt = (
+        update(book)
+        .where(book.c.book_id == book_id, book.c.copies_available < book.c.copies_total)
+        .values(copies_available=case((restored > book.c.copies_total, book.c.copies_total), else_=restored))
+    )
+    return _apply(bind, book, book_id, stmt)
+
+
+def add_copies(bind, book, book_id, n=1):
+    stmt = (
+        update(book)
+        .where(book.c.book_id == book_id)
+        .values(copies_total=book.c.copies_total + n,
+                copies_available=book.c.copies_available + n)
+    )
+    return _apply(bind, book, book_id, stmt)
+
+
+def remove_copies(bind, book, book_id, n=1):
+    """Drop n copies from the total; availability shrinks as far as it can."""
+    stmt = (
+        update(book)
+        .where(book.c.book_id == book_id, book.c.copies_total >= n)
+        .values(copies_total=book.c.copies_total - n,
+                copies_available=case((book.c.copies_available > n, book.c.copies_available - n), else_=0))
+    )
+    return _apply(bind, book, book_id, stmt)
+
+
+def release_many(bind, book, counts):
+    """Give copies back for several books in one UPDATE; counts maps book_id -> n."""
+    if not counts:
+        return
+    restored = book.c.copies_available + case(dict(counts), value=book.c.book_id, else_=0)
+    stmt = (
+        update(book)
+        .where(book.c.book_id.in_(list(counts)))
+        .values(copies_available=case((restored > book.c.copies_total, book.c.copies_total), else_=restored))
+    )
+    bind.execute(stmt)
+
+
+def take_many(bind, book, counts):
+    """
+    Take counts[book_id] copies of several books in one UPDATE. A book is only
+    touched if it has enough copies; returns the set of book_ids that succeeded.
+    """
+    if not counts:
+        return set()
+    need = case(dict(counts), value=book.c.book_id, else_=0)
+    stmt = (
+        update(book)
+        .where(book.c.book_id.in_(list(counts)), book.c.copies_available >= need)
+        .values(copies_available=book.c.copies_available - need)
+    )
+    if _dialect(bind).update_returning:
+        return {r[0] for r in bind.execute(stmt.returning(book.c.book_id))}
+    # No RETURNING (MySQL): lock the rows first so the pre-check and the UPDATE agree
+    rows = bind.execute(
+        select(book.c.book_id, book.c.copies_available)
+        .where(book.c.book_id.in_(list(counts)))
+        .with_for_update()
+    ).all()
+    ok = {r.book_id for r in rows if r.copies_available >= counts[r.book_id]}
+    if ok:
+        bind.execute(stmt.where(book.c.book_id.in_(ok)))
+    return ok
+
+
+def take_up_to(bind, book, counts):
+    """
+    Like take_many, but a book without enough copies for all of counts[book_id]
+    still gives what it has (one conditional UPDATE per copy, only for those
+    books). Returns {book_id: copies taken}.
+    """
+    ok = take_many(bind, book, counts)
+    taken = {book_id: counts[book_id] for book_id in ok}
+    for book_id, n in counts.items():
+        if book_id in ok or n < 2:
+            continue
+        got = 0
+        while got < n and take_copies(bind, book, book_id) is not None:
+            got += 1
+        if got:
+            taken[book_id] = got
+    return taken
@@ -1,21 +1,47 @@
-from flask import Flask, request, jsonify,g, abort, send_file, url_for
+from flask import Flask, request, jsonify,g, abort, send_file, url_for, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from datetime import datetime, date, time,timedelta,timezone
 import uuid
+import hmac
 import os
 import json
 import firebase_admin
 from firebase_admin import credentials, auth, db as firebase_db
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, event, update
 from werkzeug.exceptions import NotFound, Unauthorized, Forbidden
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import traceback
-import base64
 from extensions import db
 from sqlalchemy import LargeBinary, Text, String
 from werkzeug.utils import secure_filename
 from flask import send_from_directory
+from token_cache import TokenCache, AuthUser
+from search_index import SearchIndex
+from blob_store import BlobStore
+from pagination import encode_cursor, decode_cursor, parse_limit
+from book_import import BookImporter, iter_records, detect_format
+import inventory
+from expiry_scheduler import ExpiryScheduler, as_naive_utc
+from collections import Counter
+from bisect import bisect_right
+from schema_upgrade import upgrade_schema
+import query_plans
+import seat_usage
+from provisioning import provision_library
+from decimal import Decimal
+from sqlalchemy import select, bindparam, case, insert, cast, literal, Integer, Numeric, Date, DateTime
+from sqlalchemy.orm import deferred
+import click
+from seat_events import SeatEventHub, format_sse
+import queue
+from seat_map import SeatMap
+from seat_bookings import BookingIndex
+from intervals import IntervalSet, opening_intervals
+from read_cache import VersionedCache
+from opening_hours import LibrarySchedule
+from zoneinfo import ZoneInfo
+import threading
 
 app = Flask(__name__)
 CORS(app,supports_credentials=True, resources={r"/*": {"origins": "*"}})
@@ -42,6 +68,9 @@ cred_dict = json.loads(firebase_json)
 basedir = os.path.dirname(os.path.abspath(__file__))
 app.config.setdefault('MEDIA_UPLOAD_FOLDER', os.path.join(basedir, 'uploads', 'media'))
 os.makedirs(app.config['MEDIA_UPLOAD_FOLDER'], exist_ok=True)
+app.config.setdefault('COVER_STORE_FOLDER', os.path.join(basedir, 'uploads', 'covers'))
+app.config.setdefault('COVER_MAX_AGE', 31536000)
+cover_store = BlobStore(app.config['COVER_STORE_FOLDER'])
 
 
 # Create credentials and initialize
@@ -58,12 +87,17 @@ if not firebase_admin._apps:
 
 
 # --- Authentication Middleware ---
+# Verified tokens are cached until their own `exp`, so repeat calls skip
+# signature verification and the user lookup
+app.config.setdefault('TOKEN_CACHE_SIZE', int(os.getenv('TOKEN_CACHE_SIZE', '10000')))
+token_cache = TokenCache(maxsize=app.config['TOKEN_CACHE_SIZE'])
+
 @app.before_request
 def authenticate_request():
     if request.method == 'OPTIONS':
         return
     # Skip authentication for public endpoints
-    public_routes = ['register_user','update_computer','list_computers','add_book','update_book_status','update_book','search_books','get_rooms','update_seat','create_seat','seat_availability','bulk_update_hours','update_hours','get_announcements','delete_announcement','create_announcement', 'get_hours', 'search_books']
+    public_routes = ['register_user','get_cover','update_computer','list_computers','add_book','update_book_status','update_book','search_books','get_rooms','update_seat','create_seat','seat_availability','seat_free_count','seat_summary','free_computers','seat_stream','bulk_seat_state','bulk_update_hours','update_hours','get_announcements','delete_announcement','create_announcement', 'get_hours','get_hours_exceptions','library_schedule_status', 'search_books']
     if request.endpoint in public_routes:
         return
 
@@ -72,6 +106,12 @@ def authenticate_request():
         raise Unauthorized('Missing or invalid Authorization header')
 
     token = auth_header.split(' ')[1]
+    cached = token_cache.get(token)
+    if cached:
+        request.firebase_uid = cached.user.firebase_uid
+        g.current_user = cached.user
+        return
+
     try:
         decoded_token = auth.verify_id_token(token)
         request.firebase_uid = decoded_token['uid']
@@ -79,7 +119,8 @@ def authenticate_request():
         user = User.query.filter_by(firebase_uid=request.firebase_uid).first()
         if not user:
             raise NotFound('User not found in database')
-        g.current_user = user
+        g.current_user = AuthUser(user.user_id, user.firebase_uid, user.role, user.name)
+        token_cache.put(token, decoded_token, g.current_user)
     except Exception as e:
         raise Unauthorized(f'Invalid token: {str(e)}')
 
@@ -102,6 +143,12 @@ class User(db.Model):
     purchase_requests = db.relationship('PurchaseRequest', backref='user', lazy=True)
     recommendations = db.relationship('Recommendation', backref='user', lazy=True)
 
+# Any insert/update of a user (registration, role change) drops their cached tokens
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _invalidate_user_tokens(mapper, connection, target):
+    token_cache.invalidate_uid(target.firebase_uid)
+
 class Room(db.Model):
     __tablename__ = 'room'
     room_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -119,6 +166,12 @@ class Seat(db.Model):
     is_active   = db.Column(db.Boolean, default=True)
     is_occupied = db.Column(db.Boolean, default=False)
     specs       = db.Column(db.String(256), default='Standard specs')
+    # Sensor time of the last applied state report; older reports are dropped
+    state_observed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_seat_room_computer_active', 'room_id', 'is_computer', 'is_active'),
+    )
 
 
 class Book(db.Model):
@@ -131,7 +184,9 @@ class Book(db.Model):
     year = db.Column(db.Integer)
     copies_total = db.Column(db.Integer, default=1)
     copies_available = db.Column(db.Integer, default=1)
-    image= db.Column(LargeBinary, nullable=True)  
+    # Legacy inline cover; `flask migrate-covers` moves these into cover_store
+    image = deferred(db.Column(LargeBinary, nullable=True))
+    cover_hash = db.Column(db.String(64), nullable=True)
     
     # Relationships
     reservations = db.relationship('Reservation', backref='book', lazy=True)
@@ -147,6 +202,12 @@ class Reservation(db.Model):
     reserved_until = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.Enum('active', 'cancelled', 'fulfilled',name='reservation_status'), default='active')
 
+    __table_args__ = (
+        # serves the expiry sweeper's "active and due before X" scan
+        db.Index('ix_reservation_status_until', 'status', 'reserved_until'),
+        db.Index('ix_reservation_user_status', 'user_id', 'status'),
+    )
+
 class Loan(db.Model):
     __tablename__ = 'loan'
     loan_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -156,6 +217,12 @@ class Loan(db.Model):
     due_date = db.Column(db.Date, nullable=False)
     returned_date = db.Column(db.Date)
 
+    __table_args__ = (
+        # open (returned_date IS NULL) loans by due date, for fee accrual
+        db.Index('ix_loan_returned_due', 'returned_date', 'due_date'),
+        db.Index('ix_loan_user_returned', 'user_id', 'returned_date'),
+    )
+
 class FeeFine(db.Model):
     __tablename__ = 'feefine'
     feefine_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -164,6 +231,14 @@ class FeeFine(db.Model):
     description = db.Column(db.Text)
     status = db.Column(db.Enum('unpaid', 'paid',name='fee_status'), default='unpaid')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set for overdue fees maintained by accrue_overdue_fees (one per loan)
+    loan_id = db.Column(db.Integer, db.ForeignKey('loan.loan_id'), nullable=True)
+    accrued_through = db.Column(db.Date)
+
+    __table_args__ = (
+        db.Index('ux_feefine_loan', 'loan_id', unique=True),
+        db.Index('ix_feefine_user_status', 'user_id', 'status'),
+    )
 
 class Announcement(db.Model):
     __tablename__ = 'announcement'
@@ -172,6 +247,13 @@ class Announcement(db.Model):
     body = db.Column(db.Text, nullable=False)
     posted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    # Set on soft delete; the row stays as a tombstone for incremental clients
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_announcement_active_posted', 'is_active', 'posted_at'),
+        db.Index('ix_announcement_deleted_at', 'deleted_at'),
+    )
 
 class Appointment(db.Model):
     __tablename__ = 'appointment'
@@ -187,6 +269,10 @@ class Appointment(db.Model):
     # Relationships
     librarian = db.relationship('User', foreign_keys=[librarian_user_id])
 
+    __table_args__ = (
+        db.Index('ix_appointment_librarian_start', 'librarian_user_id', 'start_datetime'),
+    )
+
 class PurchaseRequest(db.Model):
     __tablename__ = 'purchaserequest'
     request_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -216,12 +302,32 @@ class OperatingTime(db.Model):
     open_time         = db.Column(db.Time, nullable=False)
     close_time        = db.Column(db.Time, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_operatingtime_library_weekday', 'library_id', 'weekday'),
+    )
+
+class LibraryHoursException(db.Model):
+    # Holiday/special hours for one date; no open/close times means closed all day
+    __tablename__ = 'library_hours_exception'
+    exception_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    library_id   = db.Column(db.Integer, db.ForeignKey('library.library_id'), nullable=False)
+    date         = db.Column(db.Date, nullable=False)
+    open_time    = db.Column(db.Time, nullable=True)
+    close_time   = db.Column(db.Time, nullable=True)
+    note         = db.Column(db.String(256))
+
+    __table_args__ = (
+        db.UniqueConstraint('library_id', 'date', name='ux_library_hours_exception_date'),
+    )
+
 class Library(db.Model):
     __tablename__ = 'library'
     library_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(256), nullable=False)
     location = db.Column(db.String(256), nullable=False)
     type = db.Column(db.String(64), nullable=False, default='Information Center')
+    # IANA zone of the opening hours; LIBRARY_TIMEZONE when unset
+    timezone = db.Column(db.String(64), nullable=True)
     
     # Relationships
     operating_hours = db.relationship('OperatingTime', backref='library', lazy=True)
@@ -247,6 +353,10 @@ class StudyRoomMember(db.Model):
     status         = db.Column(db.Enum('pending','approved','rejected',name='membership_status_enum'), default='pending')
     joined_at      = db.Column(db.DateTime)
 
+    __table_args__ = (
+        db.Index('ix_study_room_member_room_user_status', 'room_id', 'user_id', 'status'),
+    )
+
     # ← ADD THIS:
     user = db.relationship(
         'User',
@@ -276,11 +386,149 @@ class StudyRoomMindMap(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey('study_room.room_id'), unique=True)
     data = db.Column(db.JSON)  # Stores nodes and connections
+
+class BookHold(db.Model):
+    # FIFO wait list for books with no copies left; served in hold_id order
+    __tablename__ = 'book_hold'
+    hold_id        = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    book_id        = db.Column(db.Integer, db.ForeignKey('book.book_id'), nullable=False)
+    user_id        = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    library_id     = db.Column(db.Integer, db.ForeignKey('library.library_id'), nullable=False)
+    status         = db.Column(db.Enum('waiting','fulfilled','cancelled', name='hold_status_enum'), nullable=False, default='waiting')
+    created_at     = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    fulfilled_at   = db.Column(db.DateTime)
+    reservation_id = db.Column(db.Integer, db.ForeignKey('reservation.reservation_id'))
+
+    __table_args__ = (
+        db.Index('ix_book_hold_book_status', 'book_id', 'status', 'hold_id'),
+        db.Index('ix_book_hold_user_status', 'user_id', 'status'),
+    )
+
+class UserCounter(db.Model):
+    # Denormalized dashboard counts, kept in step by every reservation/loan/fee writer
+    __tablename__ = 'user_counter'
+    user_id             = db.Column(db.Integer, db.ForeignKey('user.user_id'), primary_key=True)
+    active_reservations = db.Column(db.Integer, nullable=False, default=0)
+    open_loans          = db.Column(db.Integer, nullable=False, default=0)
+    unpaid_fees         = db.Column(db.Numeric(10,2), nullable=False, default=0)
+    updated_at          = db.Column(db.DateTime, default=datetime.utcnow)
+class SeatTransition(db.Model):
+    # Append-only occupancy changes; rolled up into seat_usage by `flask rollup-seat-usage`
+    __tablename__ = 'seat_transition'
+    transition_id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    seat_id       = db.Column(db.Integer, nullable=False)
+    room_id       = db.Column(db.Integer, nullable=False)
+    at            = db.Column(db.DateTime, nullable=False)
+    is_occupied   = db.Column(db.Boolean, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_seat_transition_at', 'at'),
+    )
+
+class SeatUsageState(db.Model):
+    # Each seat's occupancy as of the last rolled-up hour
+    __tablename__ = 'seat_usage_state'
+    seat_id     = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    room_id     = db.Column(db.Integer, nullable=False)
+    is_occupied = db.Column(db.Boolean, nullable=False)
+    since       = db.Column(db.DateTime, nullable=False)
+
+class SeatUsage(db.Model):
+    # One row per room and hour ('hour'), or per day once past the hourly retention ('day')
+    __tablename__ = 'seat_usage'
+    room_id          = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    period           = db.Column(db.String(4), primary_key=True)
+    bucket_start     = db.Column(db.DateTime, primary_key=True)
+    library_id       = db.Column(db.Integer, nullable=False)
+    seats            = db.Column(db.Integer, nullable=False, default=0)
+    occupied_seconds = db.Column(db.Integer, nullable=False, default=0)
+    transitions      = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_seat_usage_library_bucket', 'library_id', 'bucket_start'),
+    )
+
+class SeatBooking(db.Model):
+    __tablename__ = 'seat_booking'
+    booking_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    seat_id    = db.Column(db.Integer, db.ForeignKey('seat.seat_id'), nullable=False)
+    user_id    = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    start_at   = db.Column(db.DateTime, nullable=False)
+    end_at     = db.Column(db.DateTime, nullable=False)
+    status     = db.Column(db.Enum('active','cancelled', name='seat_booking_status_enum'), nullable=False, default='active')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_seat_booking_seat_status_start', 'seat_id', 'status', 'start_at'),
+        db.Index('ix_seat_booking_user_status', 'user_id', 'status'),
+    )
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Add tables, columns and indexes that the models declare but the database lacks."""
+    applied = upgrade_schema(db.engine, db.metadata, echo=click.echo)
+    click.echo(f'{len(applied)} schema changes applied')
+
+# Main query of each hot endpoint; check-query-plans fails if any of them
+# falls back to a sequential scan on one of these tables
+HOT_TABLES = {'reservation', 'loan', 'feefine', 'seat', 'study_room_member', 'operatingtime'}
+
+def hot_queries():
+    today = date.today()
+    return [
+        ('user_summary / user reservations', select(Reservation).where(
+            Reservation.user_id == 1, Reservation.status == 'active')),
+        ('user_summary / open loans', select(Loan).where(
+            Loan.user_id == 1, Loan.returned_date.is_(None))),
+        ('view_fees', select(FeeFine).where(
+            FeeFine.user_id == 1, FeeFine.status == 'unpaid')),
+        ('seat_availability', select(Seat).where(
+            Seat.room_id == 1, Seat.is_computer == True, Seat.is_active == True)),
+        ('study room membership', select(StudyRoomMember.member_id).where(
+            StudyRoomMember.room_id == 1, StudyRoomMember.user_id == 1, StudyRoomMember.status == 'approved')),
+        ('get_hours / update_hours', select(OperatingTime).where(
+            OperatingTime.library_id == 1, OperatingTime.weekday == 'Mon')),
+        ('reservation sweeper', select(Reservation.reservation_id).where(
+            Reservation.status == 'active', Reservation.reserved_until <= datetime.utcnow())),
+        ('fee accrual', select(Loan.loan_id).where(
+            Loan.returned_date.is_(None), Loan.due_date < today)),
+    ]
+
+@app.cli.command('check-query-plans')
+@click.option('--seed', type=int, default=0,
+              help='First fill an EMPTY scratch database with about this many rows per hot table')
+def check_query_plans(seed):
+    """EXPLAIN each hot query and exit non-zero if one uses a sequential scan."""
+    dialect = db.engine.dialect.name
+    if not query_plans.supported(dialect):
+        raise click.ClickException(f'EXPLAIN checks are not supported on {dialect}')
+
+    if seed:
+        library_id = Library.query.first().library_id
+        with db.engine.begin() as conn:
+            query_plans.seed_hot_tables(conn, db.metadata.tables, seed, library_id, echo=click.echo)
+
+    regressions = 0
+    with db.engine.connect() as conn:
+        for name, stmt in hot_queries():
+            scans = [t for t in query_plans.full_scans(dialect, query_plans.explain(conn, stmt)) if t in HOT_TABLES]
+            if scans:
+                regressions += 1
+                click.echo(f"FAIL {name}: sequential scan on {', '.join(scans)}")
+            else:
+                click.echo(f'ok   {name}')
+    if regressions:
+        raise SystemExit(1)
+
 # Create tables
 with app.app_context():
     db.create_all()
 
-    if Library.query.count() == 0:
+    # Count by primary key only: selecting whole Library rows would fail on a database
+    # that predates a newer column, before `flask upgrade-db` gets a chance to add it
+    library_count = db.session.query(func.count(Library.library_id)).scalar()
+    if library_count == 0:
         default_libraries = [
             {
                 "name":     "Thoko Mayekiso",
@@ -295,50 +543,471 @@ with app.app_context():
         db.session.commit()
         print("🌱 Seeded 2 default libraries")
     else:
-        print(f"✅ {Library.query.count()} libraries already present, skipping seed")
+        print(f"✅ {library_count} libraries already present, skipping seed")
         
-def initialize_library(library_id=1):
-    # Create default rooms if they don't exist
-    rooms = [
-        {"name": "library-lab01", "type": "computer_lab"},
-        {"name": "library-lab02", "type": "computer_lab"},
-        {"name": "library-lab03", "type": "computer_lab"},
-        {"name": "library-lab04", "type": "computer_lab"},
-        {"name": "studyarea", "type": "study_room"},
+# Rooms and seats every new branch starts with; see provisioning.py for the format
+DEFAULT_LIBRARY_LAYOUT = {
+    'rooms': [
+        *({'name': f'library-lab0{n}', 'type': 'computer_lab',
+           'seats': [{'count': 50, 'prefix': 'Slab', 'width': 2, 'is_computer': True}]}
+          for n in range(1, 5)),
+        {'name': 'studyarea', 'type': 'study_room',
+         'seats': [{'count': 100, 'prefix': 'SSlib-'}]},
     ]
-    
-    for room_data in rooms:
-        room = Room.query.filter_by(
-            library_id=library_id,
-            name=room_data["name"]
-        ).first()
-        
-        if not room:
-            room = Room(
-                library_id=library_id,
-                name=room_data["name"],
-                room_type=room_data["type"]
+}
+
+def initialize_library(library_id=1, layout=None):
+    # Only a library with no rooms yet gets the default layout; reconciling an existing
+    # one (renamed, removed or re-flagged seats) is left to `flask provision-library`
+    if db.session.query(Room.room_id).filter_by(library_id=library_id).first() is not None:
+        return None
+    report = provision_library(db.session.connection(), db.metadata.tables, library_id,
+                               layout or DEFAULT_LIBRARY_LAYOUT)
+    db.session.commit()
+    read_cache.bump()
+    return report
+
+@app.cli.command('provision-library')
+@click.argument('library_id', type=int)
+@click.argument('layout', type=click.File('r'), required=False)
+@click.option('--prune', is_flag=True, help='Deactivate seats that are not in the layout.')
+@click.option('--dry-run', is_flag=True, help='Report the changes without writing them.')
+def provision_library_command(library_id, layout, prune, dry_run):
+    """Create/update a library's rooms and seats from a JSON layout file (default layout if omitted)."""
+    if db.session.get(Library, library_id) is None:
+        raise click.ClickException(f'Library {library_id} not found')
+    try:
+        report = provision_library(db.session.connection(), db.metadata.tables, library_id,
+                                   json.load(layout) if layout else DEFAULT_LIBRARY_LAYOUT,
+                                   prune=prune, dry_run=dry_run)
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo(json.dumps(report))
+
+# --- Per-user counters ---
+def _money(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+def user_counter_source(user_ids=None):
+    """Recount from the source tables: {user_id: (active_reservations, open_loans, unpaid_fees)}."""
+    queries = [
+        select(Reservation.user_id, func.count()).where(Reservation.status == 'active'),
+        select(Loan.user_id, func.count()).where(Loan.returned_date.is_(None)),
+        select(FeeFine.user_id, func.sum(FeeFine.amount)).where(FeeFine.status == 'unpaid'),
+    ]
+    counts = {}
+    for i, qry in enumerate(queries):
+        user_col = qry.selected_columns[0]
+        if user_ids is not None:
+            qry = qry.where(user_col.in_(user_ids))
+        for user_id, value in db.session.execute(qry.group_by(user_col)):
+            row = counts.setdefault(user_id, [0, 0, Decimal('0.00')])
+            row[i] = _money(value) if i == 2 else value
+    return {u: tuple(v) for u, v in counts.items()}
+
+def apply_counter_deltas(deltas):
+    """
+    Apply {user_id: (d_reservations, d_loans, d_fees)} to user_counter in one UPDATE,
+    inside the caller's transaction. Users without a counter row yet get one built
+    from a recount, which already includes this transaction's flushed changes.
+    """
+    deltas = {u: d for u, d in deltas.items() if any(d)}
+    if not deltas:
+        return
+    db.session.flush()
+    t = UserCounter.__table__
+
+    def delta(i, only=None):
+        return case({u: d[i] for u, d in deltas.items() if only is None or u == only},
+                    value=t.c.user_id, else_=0)
+
+    def update_stmt(user_ids, only=None):
+        return (
+            update(t)
+            .where(t.c.user_id.in_(user_ids))
+            .values(active_reservations=t.c.active_reservations + delta(0, only),
+                    open_loans=t.c.open_loans + delta(1, only),
+                    unpaid_fees=t.c.unpaid_fees + delta(2, only),
+                    updated_at=datetime.utcnow())
+        )
+
+    ids = list(deltas)
+    if db.session.execute(update_stmt(ids)).rowcount == len(ids):
+        return
+    present = set(db.session.scalars(select(t.c.user_id).where(t.c.user_id.in_(ids))))
+    missing = [u for u in ids if u not in present]
+    recounted = user_counter_source(missing)
+    for user_id in missing:
+        res, loans, fees = recounted.get(user_id, (0, 0, Decimal('0.00')))
+        try:
+            with db.session.begin_nested():
+                db.session.execute(t.insert().values(
+                    user_id=user_id, active_reservations=res, open_loans=loans,
+                    unpaid_fees=fees, updated_at=datetime.utcnow()))
+        except IntegrityError:
+            # Created concurrently from a recount that can't see our changes yet
+            db.session.execute(update_stmt([user_id], only=user_id))
+
+def bump_user_counters(user_id, reservations=0, loans=0, fees=0):
+    apply_counter_deltas({user_id: (reservations, loans, _money(fees))})
+
+@app.cli.command('reconcile-user-counters')
+@click.option('--dry-run', is_flag=True, help='Only report drift')
+def reconcile_user_counters(dry_run):
+    """Rebuild user_counter from the source tables in bulk and report drift."""
+    t = UserCounter.__table__
+    source = user_counter_source()
+    stored = {
+        r.user_id: (r.active_reservations, r.open_loans, _money(r.unpaid_fees))
+        for r in db.session.execute(select(t))
+    }
+    inserts, updates, drift = [], [], []
+    for user_id in db.session.scalars(select(User.user_id)):
+        expected = source.get(user_id, (0, 0, Decimal('0.00')))
+        have = stored.get(user_id)
+        row = {'uid': user_id, 'res': expected[0], 'loans': expected[1], 'fees': expected[2],
+               'now': datetime.utcnow()}
+        if have is None:
+            inserts.append(row)
+        elif have != expected:
+            updates.append(row)
+            drift.append((user_id, have, expected))
+
+    for user_id, have, expected in drift[:50]:
+        click.echo(f'user {user_id}: stored {have} != source {expected}')
+    click.echo(f'{len(drift)} drifted, {len(inserts)} missing counter rows')
+    if dry_run:
+        return
+
+    if inserts:
+        db.session.execute(
+            t.insert().values(user_id=bindparam('uid'), active_reservations=bindparam('res'),
+                              open_loans=bindparam('loans'), unpaid_fees=bindparam('fees'),
+                              updated_at=bindparam('now')),
+            inserts)
+    if updates:
+        db.session.execute(
+            update(t).where(t.c.user_id == bindparam('uid'))
+            .values(active_reservations=bindparam('res'), open_loans=bindparam('loans'),
+                    unpaid_fees=bindparam('fees'), updated_at=bindparam('now')),
+            updates)
+    db.session.commit()
+    click.echo(f'Rebuilt {len(inserts) + len(updates)} counter rows')
+
+# --- Hold queue ---
+HOLD_RESERVATION_HOURS = 2
+
+def fulfil_holds(book_ids):
+    """
+    Hand freed copies to the oldest waiting holds of each book, in the caller's
+    transaction. Returns the fulfilled holds; pass them to publish_hold_updates()
+    after the commit.
+    """
+    fulfilled = []
+    now = datetime.utcnow()
+    for book_id in set(book_ids):
+        while True:
+            holds = (
+                BookHold.query
+                .filter_by(book_id=book_id, status='waiting')
+                .order_by(BookHold.hold_id)
+                .limit(20)
+                .with_for_update()
+                .all()
             )
-            db.session.add(room)
-            db.session.commit()
-            
-            # Create seats for this room
-            seat_count = 50 if "lab" in room_data["name"] else 100
-            prefix = "Slab" if "lab" in room_data["name"] else "SSlib-"
-            
-            for i in range(1, seat_count + 1):
-                identifier = f"{prefix}{i:02d}" if "lab" in room_data["name"] else f"{prefix}{i}"
-                
-                seat = Seat(
-                    room_id=room.room_id,
-                    identifier=identifier,
-                    is_computer=("lab" in room_data["name"]),
-                    is_active=True,
-                    is_occupied=False
+            if not holds:
+                break
+            for hold in holds:
+                if inventory.take_copies(db.session, Book.__table__, book_id) is None:
+                    break
+                reservation = Reservation(
+                    user_id=hold.user_id,
+                    book_id=book_id,
+                    library_id=hold.library_id,
+                    reserved_from=now,
+                    reserved_until=now + timedelta(hours=HOLD_RESERVATION_HOURS)
                 )
-                db.session.add(seat)
-    
+                db.session.add(reservation)
+                db.session.flush()
+                hold.status = 'fulfilled'
+                hold.fulfilled_at = now
+                hold.reservation_id = reservation.reservation_id
+                bump_user_counters(hold.user_id, reservations=1)
+                fulfilled.append((hold, reservation))
+            else:
+                continue
+            break
+    return fulfilled
+
+def serialize_hold(hold, position=None):
+    return {
+        'hold_id':        hold.hold_id,
+        'book_id':        hold.book_id,
+        'status':         hold.status,
+        'position':       position,
+        'created_at':     hold.created_at.isoformat(),
+        'fulfilled_at':   hold.fulfilled_at.isoformat() if hold.fulfilled_at else None,
+        'reservation_id': hold.reservation_id
+    }
+
+def publish_hold_updates(fulfilled):
+    """
+    Push fulfilled holds to holds/<firebase_uid>/<hold_id> in the Realtime Database,
+    so apps listen there instead of polling reserve_book.
+    """
+    if not fulfilled:
+        return
+    uids = dict(
+        db.session.query(User.user_id, User.firebase_uid)
+        .filter(User.user_id.in_({h.user_id for h, _ in fulfilled}))
+        .all()
+    )
+    for hold, reservation in fulfilled:
+        reservation_sweeper.schedule(reservation.reservation_id, reservation.reserved_until)
+        payload = serialize_hold(hold)
+        payload['reserved_until'] = reservation.reserved_until.isoformat()
+        try:
+            firebase_db.reference(f'holds/{uids[hold.user_id]}/{hold.hold_id}').set(payload)
+        except Exception:
+            app.logger.exception(f'Failed to publish hold {hold.hold_id}')
+
+def hold_position(hold):
+    if hold.status != 'waiting':
+        return None
+    return BookHold.query.filter(
+        BookHold.book_id == hold.book_id,
+        BookHold.status == 'waiting',
+        BookHold.hold_id <= hold.hold_id
+    ).count()
+
+def place_hold(book_id, user_id, library_id):
+    existing = BookHold.query.filter_by(book_id=book_id, user_id=user_id, status='waiting').first()
+    if existing:
+        return jsonify(serialize_hold(existing, hold_position(existing))), 200
+    hold = BookHold(book_id=book_id, user_id=user_id, library_id=library_id)
+    db.session.add(hold)
+    db.session.flush()
+    # A copy may have come back since the caller found none (or there was one all along)
+    fulfilled = fulfil_holds([book_id])
     db.session.commit()
+    publish_hold_updates(fulfilled)
+    if hold.status == 'fulfilled':
+        return jsonify(serialize_hold(hold)), 201
+    return jsonify(serialize_hold(hold, hold_position(hold))), 202
+
+# --- Reservation expiry ---
+app.config.setdefault('RESERVATION_SWEEPER_ENABLED', os.getenv('RESERVATION_SWEEPER_ENABLED', 'true') == 'true')
+app.config.setdefault('RESERVATION_SWEEP_BATCH', 500)
+
+def expire_reservations(reservation_ids=None, limit=None):
+    """Cancel due active reservations and give their copies back. Returns how many expired."""
+    now = datetime.utcnow()
+    qry = (
+        db.session.query(Reservation.reservation_id, Reservation.book_id, Reservation.user_id)
+        .filter(Reservation.status == 'active', Reservation.reserved_until <= now)
+    )
+    if reservation_ids is not None:
+        qry = qry.filter(Reservation.reservation_id.in_(reservation_ids))
+    if limit:
+        qry = qry.limit(limit)
+    # Row locks make concurrent sweepers (one per worker) skip rows another already flipped
+    rows = qry.with_for_update().all()
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    stmt = (
+        update(Reservation.__table__)
+        .where(Reservation.reservation_id.in_([r.reservation_id for r in rows]),
+               Reservation.status == 'active')
+        .values(status='cancelled')
+    )
+    # Only give back copies of reservations this sweep actually flipped; one that was
+    # collected meanwhile is out on loan
+    if db.session.get_bind().dialect.update_returning:
+        expired = {r[0] for r in db.session.execute(stmt.returning(Reservation.reservation_id))}
+        rows = [r for r in rows if r.reservation_id in expired]
+    else:
+        # No RETURNING (MySQL): the rows are locked above, so none can have changed
+        db.session.execute(stmt)
+    if not rows:
+        db.session.rollback()
+        return 0
+    inventory.release_many(db.session, Book.__table__, Counter(r.book_id for r in rows))
+    per_user = Counter(r.user_id for r in rows)
+    apply_counter_deltas({u: (-n, 0, 0) for u, n in per_user.items()})
+    fulfilled = fulfil_holds(r.book_id for r in rows)
+    db.session.commit()
+    publish_hold_updates(fulfilled)
+    return len(rows)
+
+def _expire_batch(reservation_ids):
+    with app.app_context():
+        return expire_reservations(reservation_ids)
+
+def _load_upcoming_expiries(until):
+    with app.app_context():
+        return (
+            db.session.query(Reservation.reservation_id, Reservation.reserved_until)
+            .filter(Reservation.status == 'active', Reservation.reserved_until <= until)
+            .all()
+        )
+
+reservation_sweeper = ExpiryScheduler(
+    _expire_batch, _load_upcoming_expiries,
+    batch_size=app.config['RESERVATION_SWEEP_BATCH']
+)
+
+@app.before_request
+def start_reservation_sweeper():
+    # Started lazily so each gunicorn worker runs its own thread after the fork
+    if app.config['RESERVATION_SWEEPER_ENABLED']:
+        reservation_sweeper.start()
+
+@app.cli.command('expire-reservations')
+def expire_reservations_command():
+    """One-off sweep of every overdue active reservation."""
+    total = 0
+    while True:
+        n = expire_reservations(limit=app.config['RESERVATION_SWEEP_BATCH'])
+        if not n:
+            break
+        total += n
+    click.echo(f'Expired {total} reservations')
+
+# --- Seat occupancy stream ---
+# One hub per worker holds each watched library's seat states; writers publish after
+# commit and every stream subscriber reads from its own queue, never from the DB.
+app.config.setdefault('SEAT_STREAM_RESYNC_SECONDS', float(os.getenv('SEAT_STREAM_RESYNC_SECONDS', '5')))
+app.config.setdefault('SEAT_SUMMARY_MAX_AGE', int(os.getenv('SEAT_SUMMARY_MAX_AGE', '5')))
+app.config.setdefault('SEAT_USAGE_HOURLY_DAYS', int(os.getenv('SEAT_USAGE_HOURLY_DAYS', '400')))
+app.config.setdefault('SEAT_USAGE_RAW_DAYS', int(os.getenv('SEAT_USAGE_RAW_DAYS', '14')))
+app.config.setdefault('SEAT_SENSOR_TOKEN', os.getenv('SEAT_SENSOR_TOKEN'))
+app.config.setdefault('SEAT_STREAM_HEARTBEAT_SECONDS', float(os.getenv('SEAT_STREAM_HEARTBEAT_SECONDS', '15')))
+
+def seat_state(s):
+    return {
+        'seat_id': s.seat_id,
+        'identifier': s.identifier,
+        'is_computer': s.is_computer,
+        'is_active': s.is_active,
+        'is_occupied': s.is_occupied,
+        'room_id': s.room_id,
+        'specs': s.specs,
+    }
+
+def _seat_rows(library_id=None):
+    seat, room = Seat.__table__, Room.__table__
+    stmt = (
+        select(seat.c.seat_id, seat.c.identifier, seat.c.is_computer, seat.c.is_active,
+               seat.c.is_occupied, seat.c.room_id, seat.c.specs, room.c.library_id,
+               room.c.name.label('room_name'))
+        .join(room, room.c.room_id == seat.c.room_id)
+    )
+    if library_id is not None:
+        stmt = stmt.where(room.c.library_id == library_id)
+    # Own connection, returned to the pool straight away: streams are long-lived
+    with db.engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+def _load_seat_states(library_id):
+    return [seat_state(r) for r in _seat_rows(library_id)]
+
+seat_hub = SeatEventHub(_load_seat_states, resync_interval=app.config['SEAT_STREAM_RESYNC_SECONDS'])
+
+# Per-room occupancy bitmasks answer availability and free counts without the DB.
+# Loaded on first use in each worker, then written through by the seat endpoints.
+# Other workers' writes are picked up when the whole map is checked against the DB
+# every SEAT_MAP_VERIFY_SECONDS. Deployments that need tighter bounds can set
+# SEAT_MAP_FRESH_SECONDS to have reads re-fetch a library's seats (one indexed query)
+# once they are older than that; it is off (0) by default, keeping reads off the DB.
+app.config.setdefault('SEAT_MAP_FRESH_SECONDS', float(os.getenv('SEAT_MAP_FRESH_SECONDS', '0')))
+app.config.setdefault('SEAT_MAP_VERIFY_SECONDS', float(os.getenv('SEAT_MAP_VERIFY_SECONDS', '60')))
+seat_map = SeatMap()
+_seat_map_lock = threading.Lock()
+_seat_map_verifier = None
+
+def _seat_map_rows():
+    return [dict(seat_state(r), library_id=r.library_id, room_name=r.room_name) for r in _seat_rows()]
+
+def ensure_seat_map():
+    if not seat_map.loaded:
+        with _seat_map_lock:
+            if not seat_map.loaded:
+                seat_map.load(_seat_map_rows())
+    return seat_map
+
+def fresh_seat_map(library_id=None):
+    """The seat map, with `library_id` (None: every library) re-read if it is older than SEAT_MAP_FRESH_SECONDS."""
+    ensure_seat_map()
+    max_age = app.config['SEAT_MAP_FRESH_SECONDS']
+    if max_age > 0 and seat_map.is_stale(library_id, max_age):
+        if library_id is None:
+            seat_map.load(_seat_map_rows())
+        else:
+            rows = _seat_rows(library_id)
+            seat_map.load_library(library_id, [dict(seat_state(r), room_name=r.room_name) for r in rows])
+    return seat_map
+
+def verify_seat_map(repair=True):
+    """Compare the map with the seat table; returns the mismatched seat ids."""
+    rows = _seat_map_rows()
+    mismatched = seat_map.diff(rows)
+    if mismatched and repair:
+        app.logger.warning(f'Seat map out of sync for {len(mismatched)} seats, reloading')
+        seat_map.load(rows)
+    return mismatched
+
+def _run_seat_map_verifier():
+    wake = threading.Event()
+    while not wake.wait(app.config['SEAT_MAP_VERIFY_SECONDS']):
+        try:
+            with app.app_context():
+                verify_seat_map()
+        except Exception:
+            app.logger.exception('Seat map verification failed')
+
+@app.before_request
+def start_seat_map_verifier():
+    global _seat_map_verifier
+    if _seat_map_verifier is None and app.config['SEAT_MAP_VERIFY_SECONDS'] > 0:
+        with _seat_map_lock:
+            if _seat_map_verifier is None:
+                _seat_map_verifier = threading.Thread(target=_run_seat_map_verifier,
+                                                      name='seat-map-verifier', daemon=True)
+                _seat_map_verifier.start()
+
+def record_occupancy(changes):
+    """Append (seat_id, room_id, is_occupied, at) occupancy changes to seat_transition, before commit."""
+    if changes:
+        db.session.execute(insert(SeatTransition.__table__), [
+            {'seat_id': seat_id, 'room_id': room_id, 'is_occupied': bool(occ), 'at': at}
+            for seat_id, room_id, occ, at in changes])
+
+def seat_written(library_id, state):
+    """Call with seat_state(...) after committing a seat write: updates the seat map and the live stream."""
+    if seat_map.loaded:
+        seat_map.put(library_id, state)
+    seat_hub.publish(library_id, state)
+
+# --- Read cache ---
+# Libraries, rooms and opening hours change a few times a term. Their rendered JSON is
+# cached per worker until a room/hours writer calls read_cache.bump() (or READ_CACHE_TTL
+# passes, for writes made by other workers); If-None-Match hits answer 304 with no SQL.
+app.config.setdefault('READ_CACHE_TTL', float(os.getenv('READ_CACHE_TTL', '60')))
+read_cache = VersionedCache(ttl=app.config['READ_CACHE_TTL'])
+
+def cached_json(key, render, cache=read_cache):
+    body, etag = cache.get(key, lambda: app.json.dumps(render()))
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
 
 # --- API Endpoints ---
 
@@ -348,28 +1017,284 @@ def seat_availability(library_id):
     is_computer = request.args.get('is_computer', type=str)
     room_id = request.args.get('room_id', type=int)
     active_only = request.args.get('active', 'true') == 'true'
-    
-    # Join with Room to filter by library
-    query = Seat.query.join(Room).filter(Room.library_id == library_id)
-    
-    # Add room filter if provided
-    if room_id:
-        query = query.filter(Seat.room_id == room_id)
-    
+
     if is_computer and is_computer.lower() in ['true', 'false']:
-        query = query.filter(Seat.is_computer == (is_computer.lower() == 'true'))
-    if active_only:
-        query = query.filter(Seat.is_active == True)
-    
-    seats = query.all()
-    return jsonify([{
-        'seat_id': s.seat_id,
-        'identifier': s.identifier,
-        'is_computer': s.is_computer,
-        'is_active': s.is_active,
-        'is_occupied': s.is_occupied,
-        'room_id': s.room_id
-    } for s in seats])
+        is_computer = is_computer.lower() == 'true'
+    else:
+        is_computer = None
+
+    seats = fresh_seat_map(library_id).seats(library_id, room_id=room_id or None,
+                                    is_computer=is_computer, active_only=active_only)
+    for s in seats:
+        del s['specs']
+    return jsonify(seats)
+
+# Free (active, unoccupied) seat count, answered from the seat map
+@app.route('/libraries/<int:library_id>/seats/free_count', methods=['GET'])
+def seat_free_count(library_id):
+    room_id = request.args.get('room_id', type=int)
+    is_computer = request.args.get('is_computer', type=str)
+    if is_computer and is_computer.lower() in ['true', 'false']:
+        is_computer = is_computer.lower() == 'true'
+    else:
+        is_computer = None
+    return jsonify({
+        'library_id': library_id,
+        'room_id': room_id,
+        'free': fresh_seat_map(library_id).free_count(library_id, room_id=room_id, is_computer=is_computer)
+    })
+
+# Occupancy counts per room and library for dashboards/kiosks, from the seat map
+@app.route('/libraries/seats/summary', methods=['GET'])
+@app.route('/libraries/<int:library_id>/seats/summary', methods=['GET'])
+def seat_summary(library_id=None):
+    libraries = fresh_seat_map(library_id).summary(library_id)
+    if library_id is not None:
+        body = libraries[0] if libraries else {
+            'library_id': library_id, 'total': 0, 'active': 0, 'occupied': 0, 'free': 0,
+            'computers': 0, 'computers_free': 0, 'rooms': []}
+    else:
+        body = {'libraries': libraries}
+    resp = jsonify(body)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = app.config['SEAT_SUMMARY_MAX_AGE']
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+# Utilisation history per hour/day or as a weekday x hour heatmap, from the seat_usage rollups
+SEAT_USAGE_MAX_DAYS = 731
+
+@app.route('/libraries/<int:library_id>/seats/usage', methods=['GET'])
+def seat_usage_history(library_id):
+    if g.current_user.role != 'staff':
+        raise Forbidden('Only staff can view seat usage')
+    try:
+        start, end = date_range_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    end = end or date.today()
+    start = start or end - timedelta(days=6)
+    if start > end or (end - start).days >= SEAT_USAGE_MAX_DAYS:
+        return jsonify({'error': f'Range must be between 1 and {SEAT_USAGE_MAX_DAYS} days'}), 400
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in ('hour', 'day', 'heatmap'):
+        return jsonify({'error': "granularity must be 'hour', 'day' or 'heatmap'"}), 400
+
+    rows = seat_usage.usage_series(
+        db.session.connection(), db.metadata.tables, library_id,
+        datetime.combine(start, time()), datetime.combine(end + timedelta(days=1), time()),
+        room_id=request.args.get('room_id', type=int))
+
+    body = {'library_id': library_id, 'from': start.isoformat(), 'to': end.isoformat(),
+            'granularity': granularity}
+    if granularity == 'heatmap':
+        # weekday (0 = Monday) x hour of mean utilisation; days past the hourly retention are skipped
+        cells = {}
+        for r in rows:
+            if r.period != 'hour':
+                continue
+            cell = cells.setdefault((r.bucket_start.weekday(), r.bucket_start.hour), [0, 0])
+            cell[0] += r.occupied_seconds
+            cell[1] += r.seats * 3600
+        body['heatmap'] = [[round(cells[d, h][0] / cells[d, h][1], 4) if cells.get((d, h), [0, 0])[1] else None
+                            for h in range(24)] for d in range(7)]
+        return jsonify(body)
+
+    buckets = []
+    for r in rows:
+        period, bucket_start = r.period, r.bucket_start
+        if granularity == 'day' and period == 'hour':
+            period, bucket_start = 'day', datetime.combine(r.bucket_start.date(), time())
+            if buckets and buckets[-1]['start'] == bucket_start:
+                b = buckets[-1]
+                b['seats'] = max(b['seats'], r.seats)
+                b['occupied_seconds'] += r.occupied_seconds
+                b['transitions'] += r.transitions
+                continue
+        buckets.append({'start': bucket_start, 'period': period, 'seats': int(r.seats),
+                        'occupied_seconds': int(r.occupied_seconds), 'transitions': int(r.transitions)})
+    for b in buckets:
+        b['utilisation'] = seat_usage.utilisation(b['seats'], b['occupied_seconds'], b['period'])
+        b['start'] = b['start'].isoformat()
+    body['buckets'] = buckets
+    return jsonify(body)
+
+@app.cli.command('rollup-seat-usage')
+def rollup_seat_usage_command():
+    """Roll seat transitions up into hourly usage and apply the retention policy; run from cron."""
+    hours = 0
+    while True:
+        n = seat_usage.rollup(db.session.connection(), db.metadata.tables, datetime.utcnow())
+        db.session.commit()
+        if not n:
+            break
+        hours += n
+    merged, removed = seat_usage.downsample(db.session.connection(), db.metadata.tables, datetime.utcnow(),
+                                            hourly_days=app.config['SEAT_USAGE_HOURLY_DAYS'],
+                                            raw_days=app.config['SEAT_USAGE_RAW_DAYS'])
+    db.session.commit()
+    click.echo(f'Rolled up {hours} hours; merged {merged} hourly rows into days; '
+               f'deleted {removed} raw transitions')
+
+# --- Seat bookings ---
+# Upcoming active bookings are mirrored per worker in a per-seat interval index, reloaded
+# every SEAT_BOOKING_REFRESH_SECONDS to pick up other workers' bookings.
+SEAT_BOOKING_MAX_HOURS = 4
+SEAT_BOOKING_MAX_DAYS_AHEAD = 30
+app.config.setdefault('SEAT_BOOKING_REFRESH_SECONDS', float(os.getenv('SEAT_BOOKING_REFRESH_SECONDS', '30')))
+booking_index = BookingIndex()
+_booking_index_lock = threading.Lock()
+
+def ensure_booking_index():
+    max_age = app.config['SEAT_BOOKING_REFRESH_SECONDS']
+    if booking_index.is_stale(max_age):
+        with _booking_index_lock:
+            if booking_index.is_stale(max_age):
+                booking_index.load(
+                    db.session.query(SeatBooking.booking_id, SeatBooking.seat_id,
+                                     SeatBooking.start_at, SeatBooking.end_at)
+                    .filter(SeatBooking.status == 'active', SeatBooking.end_at > datetime.utcnow())
+                    .all()
+                )
+    return booking_index
+
+def booking_window(data):
+    """(start, end) as naive UTC from ISO 8601 'start'/'end'; raises ValueError."""
+    try:
+        start = as_naive_utc(datetime.fromisoformat(str(data['start']).replace('Z', '+00:00')))
+        end = as_naive_utc(datetime.fromisoformat(str(data['end']).replace('Z', '+00:00')))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("'start' and 'end' must be ISO 8601 datetimes")
+    now = datetime.utcnow()
+    if end <= start:
+        raise ValueError('End time must be after start time')
+    if end - start > timedelta(hours=SEAT_BOOKING_MAX_HOURS):
+        raise ValueError(f'Bookings are limited to {SEAT_BOOKING_MAX_HOURS} hours')
+    if end <= now or start > now + timedelta(days=SEAT_BOOKING_MAX_DAYS_AHEAD):
+        raise ValueError(f'Bookings must end in the future and start within {SEAT_BOOKING_MAX_DAYS_AHEAD} days')
+    return start, end
+
+def serialize_seat_booking(b):
+    return {
+        'booking_id': b.booking_id,
+        'seat_id': b.seat_id,
+        'user_id': b.user_id,
+        'start': b.start_at.isoformat(),
+        'end': b.end_at.isoformat(),
+        'status': b.status
+    }
+
+@app.route('/libraries/<int:library_id>/seats/<int:seat_id>/bookings', methods=['POST'])
+def book_seat(library_id, seat_id):
+    try:
+        start, end = booking_window(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The index can lag cancellations made on other workers, so a hit there is only
+    # a hint; the locked DB check below decides
+    hinted = ensure_booking_index().conflicts(seat_id, start, end)
+
+    # Lock the seat row so concurrent bookings of the same seat serialize
+    seat = (
+        db.session.query(Seat.seat_id, Seat.is_active)
+        .join(Room)
+        .filter(Seat.seat_id == seat_id, Room.library_id == library_id)
+        .with_for_update(of=Seat)
+        .first()
+    )
+    if not seat:
+        return jsonify({'error': 'Seat not found in this library'}), 404
+    if not seat.is_active:
+        return jsonify({'error': 'Seat is not active'}), 400
+    clash = (
+        db.session.query(SeatBooking.booking_id, SeatBooking.start_at, SeatBooking.end_at)
+        .filter(SeatBooking.seat_id == seat_id, SeatBooking.status == 'active',
+                SeatBooking.start_at < end, SeatBooking.end_at > start)
+        .first()
+    )
+    if clash:
+        db.session.rollback()
+        booking_index.add(seat_id, clash.booking_id, clash.start_at, clash.end_at)
+        return jsonify({'error': 'Seat is already booked for this time'}), 409
+    # Whatever the index had here was cancelled elsewhere
+    for booking_id in hinted:
+        booking_index.remove(seat_id, booking_id)
+
+    booking = SeatBooking(seat_id=seat_id, user_id=g.current_user.user_id, start_at=start, end_at=end)
+    db.session.add(booking)
+    db.session.commit()
+    booking_index.add(seat_id, booking.booking_id, start, end)
+    return jsonify(serialize_seat_booking(booking)), 201
+
+@app.route('/libraries/<int:library_id>/seats/<int:seat_id>/bookings', methods=['GET'])
+def seat_bookings(library_id, seat_id):
+    try:
+        start, end = date_range_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    start = datetime.combine(start, time()) if start else datetime.utcnow()
+    end = datetime.combine(end + timedelta(days=1), time()) if end else start + timedelta(days=7)
+    bookings = (
+        SeatBooking.query
+        .join(Seat).join(Room)
+        .filter(SeatBooking.seat_id == seat_id, Room.library_id == library_id,
+                SeatBooking.status == 'active',
+                SeatBooking.start_at < end, SeatBooking.end_at > start)
+        .order_by(SeatBooking.start_at)
+        .all()
+    )
+    return jsonify([serialize_seat_booking(b) for b in bookings])
+
+@app.route('/seat-bookings/<int:booking_id>', methods=['DELETE'])
+def cancel_seat_booking(booking_id):
+    booking = SeatBooking.query.get_or_404(booking_id)
+    if booking.user_id != g.current_user.user_id and g.current_user.role != 'staff':
+        raise Forbidden('You can only cancel your own bookings')
+    if booking.status == 'active':
+        booking.status = 'cancelled'
+        db.session.commit()
+        booking_index.remove(booking.seat_id, booking.booking_id)
+    return jsonify(serialize_seat_booking(booking)), 200
+
+# Any active computer in the library with no booking overlapping ?start=&end=
+# (?room_id=, ?limit=); answered from the seat map and the booking index
+@app.route('/libraries/<int:library_id>/computers/free', methods=['GET'])
+def free_computers(library_id):
+    try:
+        start, end = booking_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = request.args.get('limit', 20, type=int)
+    index = ensure_booking_index()
+    # Someone sitting at it right now only matters if the window has already started
+    started = start <= datetime.utcnow()
+    free = []
+    for s in fresh_seat_map(library_id).seats(library_id, room_id=request.args.get('room_id', type=int),
+                                     is_computer=True, active_only=True):
+        if started and s['is_occupied']:
+            continue
+        if index.is_free(s['seat_id'], start, end):
+            free.append({'computer_id': s['seat_id'], 'identifier': s['identifier'],
+                         'specs': s['specs'], 'room_id': s['room_id']})
+            if len(free) >= limit:
+                break
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'computers': free})
+
+# Staff: check this worker's seat map against the database
+@app.route('/libraries/seats/map/check', methods=['GET'])
+def check_seat_map():
+    if g.current_user.role != 'staff':
+        raise Forbidden('Only staff can check the seat map')
+    ensure_seat_map()
+    repair = request.args.get('repair', 'false') == 'true'
+    mismatched = verify_seat_map(repair=repair)
+    return jsonify({
+        'seats': len(seat_map),
+        'mismatched': len(mismatched),
+        'seat_ids': mismatched[:100],
+        'repaired': bool(mismatched) and repair
+    })
 
 # Create Seat
 @app.route('/libraries/<int:library_id>/seats', methods=['POST'])
@@ -397,7 +1322,11 @@ def create_seat(library_id):
         is_occupied=bool(is_occupied)
     )
     db.session.add(s)
+    db.session.flush()
+    if s.is_occupied:
+        record_occupancy([(s.seat_id, s.room_id, True, datetime.utcnow())])
     db.session.commit()
+    seat_written(library_id, seat_state(s))
 
     return jsonify({
         'seat_id': s.seat_id,
@@ -418,6 +1347,7 @@ def update_seat(library_id, seat_id):
     room = Room.query.filter_by(room_id=s.room_id, library_id=library_id).first()
     if not room:
         abort(404)
+    was = (s.is_occupied, s.room_id)
 
     if 'identifier' in data:
         s.identifier = data['identifier']
@@ -433,7 +1363,10 @@ def update_seat(library_id, seat_id):
         if new_room:
             s.room_id = data['room_id']
 
+    if (s.is_occupied, s.room_id) != was:
+        record_occupancy([(s.seat_id, s.room_id, s.is_occupied, datetime.utcnow())])
     db.session.commit()
+    seat_written(library_id, seat_state(s))
     return jsonify({
         'seat_id': s.seat_id,
         'identifier': s.identifier,
@@ -443,56 +1376,369 @@ def update_seat(library_id, seat_id):
         'room_id': s.room_id
     }), 200
 
+# Bulk seat state from occupancy sensors / lab login agents
+SEAT_STATE_MAX_UPDATES = 1000
+
+def _observed_at(raw, default):
+    if raw is None:
+        return default
+    return as_naive_utc(datetime.fromisoformat(str(raw).replace('Z', '+00:00')))
+
+@app.route('/libraries/<int:library_id>/seats/state', methods=['POST'])
+def bulk_seat_state(library_id):
+    """
+    Body: {"observed_at": "...", "updates": [{"seat_id": 1, "is_occupied": true,
+           "is_active": true, "observed_at": "..."}, ...]}
+    observed_at is the sensor's clock (ISO 8601, per update or for the whole batch,
+    default now). A report older than the last one applied to that seat is skipped
+    as stale. One ownership query and one UPDATE regardless of batch size.
+    """
+    # Public route, so the token is the only guard: without one configured, refuse
+    token = app.config['SEAT_SENSOR_TOKEN']
+    if not token:
+        raise Unauthorized('Sensor updates are disabled (SEAT_SENSOR_TOKEN is not set)')
+    if not hmac.compare_digest(request.headers.get('X-Sensor-Token', ''), token):
+        raise Unauthorized('Invalid sensor token')
+
+    data = request.get_json() or {}
+    updates = data.get('updates') or []
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'error': 'updates must be a non-empty list'}), 400
+    if len(updates) > SEAT_STATE_MAX_UPDATES:
+        return jsonify({'error': f'At most {SEAT_STATE_MAX_UPDATES} updates per request'}), 400
+    try:
+        batch_at = _observed_at(data.get('observed_at'), datetime.utcnow())
+    except ValueError:
+        return jsonify({'error': 'Invalid observed_at'}), 400
+
+    # 1) Validate; the newest report per seat wins within the batch
+    results = [{'index': i} for i in range(len(updates))]
+    latest = {}
+    for res, u in zip(results, updates):
+        u = u or {}
+        try:
+            seat_id = int(u['seat_id'])
+            at = _observed_at(u.get('observed_at'), batch_at)
+        except (KeyError, TypeError, ValueError):
+            res.update(status='error', error='seat_id and a valid observed_at are required')
+            continue
+        res['seat_id'] = seat_id
+        change = {k: bool(u[k]) for k in ('is_occupied', 'is_active') if k in u}
+        if not change:
+            res.update(status='error', error='Nothing to update')
+            continue
+        prev = latest.get(seat_id)
+        if prev is not None and prev[0] >= at:
+            res['status'] = 'stale'
+            continue
+        if prev is not None:
+            prev[2]['status'] = 'stale'
+        latest[seat_id] = (at, change, res)
+
+    # 2) One query for ownership and the last applied sensor time
+    seat, room = Seat.__table__, Room.__table__
+    owned = {}
+    if latest:
+        stmt = (
+            select(seat.c.seat_id, seat.c.identifier, seat.c.is_computer, seat.c.is_active,
+                   seat.c.is_occupied, seat.c.room_id, seat.c.specs, seat.c.state_observed_at)
+            .join(room, room.c.room_id == seat.c.room_id)
+            .where(room.c.library_id == library_id, seat.c.seat_id.in_(list(latest)))
+        )
+        returning = db.session.get_bind().dialect.update_returning
+        if not returning:
+            # No RETURNING (MySQL): lock the rows so the staleness check and the UPDATE agree
+            stmt = stmt.with_for_update(of=seat)
+        owned = {r.seat_id: r for r in db.session.execute(stmt)}
+
+    apply = {}
+    for seat_id, (at, change, res) in latest.items():
+        row = owned.get(seat_id)
+        if row is None:
+            res.update(status='error', error='Seat not found in this library')
+        elif row.state_observed_at is not None and row.state_observed_at >= at:
+            res['status'] = 'stale'
+        else:
+            apply[seat_id] = (at, change, res)
+
+    # 3) One UPDATE; the timestamp guard also covers reports racing in other requests
+    applied = set()
+    if apply:
+        at_case = case({k: v[0] for k, v in apply.items()}, value=seat.c.seat_id)
+        values = {'state_observed_at': at_case}
+        for col in ('is_occupied', 'is_active'):
+            given = {k: v[1][col] for k, v in apply.items() if col in v[1]}
+            if given:
+                values[col] = case(given, value=seat.c.seat_id, else_=seat.c[col])
+        stmt = (
+            update(seat)
+            .where(seat.c.seat_id.in_(list(apply)),
+                   or_(seat.c.state_observed_at.is_(None), seat.c.state_observed_at < at_case))
+            .values(**values)
+        )
+        if returning:
+            applied = {r[0] for r in db.session.execute(stmt.returning(seat.c.seat_id))}
+        else:
+            db.session.execute(stmt)
+            applied = set(apply)
+        record_occupancy([
+            (seat_id, owned[seat_id].room_id, change['is_occupied'], at)
+            for seat_id, (at, change, res) in apply.items()
+            if seat_id in applied and 'is_occupied' in change
+            and change['is_occupied'] != bool(owned[seat_id].is_occupied)
+        ])
+    db.session.commit()
+
+    for seat_id, (at, change, res) in apply.items():
+        if seat_id not in applied:
+            res['status'] = 'stale'
+            continue
+        res['status'] = 'ok'
+        seat_written(library_id, dict(seat_state(owned[seat_id]), **change))
+
+    counts = Counter(r.get('status') for r in results)
+    return jsonify({
+        'applied': counts['ok'],
+        'stale': counts['stale'],
+        'failed': counts['error'],
+        'results': results
+    }), 200
+
+# Staff: apply a declarative room/seat layout to a library (?prune=true, ?dry_run=true)
+@app.route('/libraries/<int:library_id>/layout', methods=['POST'])
+def apply_library_layout(library_id):
+    if g.current_user.role != 'staff':
+        raise Forbidden('Only staff can provision libraries')
+    if db.session.get(Library, library_id) is None:
+        return jsonify({'error': 'Library not found'}), 404
+    try:
+        report = provision_library(db.session.connection(), db.metadata.tables, library_id,
+                                   request.get_json() or {},
+                                   prune=request.args.get('prune', 'false') == 'true',
+                                   dry_run=request.args.get('dry_run', 'false') == 'true')
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    if not report['dry_run']:
+        read_cache.bump()
+    # The live stream catches up on its next resync
+    if seat_map.loaded and not report['dry_run']:
+        seat_map.load(_seat_map_rows())
+    return jsonify(report), 200
+
+# Live seat/computer occupancy (Server-Sent Events): a snapshot, then per-seat deltas.
+# Reconnecting clients send Last-Event-ID and only receive what they missed; an id from
+# another worker or an earlier channel gets a fresh snapshot.
+@app.route('/libraries/<int:library_id>/seats/stream', methods=['GET'])
+def seat_stream(library_id):
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    sub, initial = seat_hub.subscribe(library_id, last_event_id)
+    wait = min(app.config['SEAT_STREAM_HEARTBEAT_SECONDS'], app.config['SEAT_STREAM_RESYNC_SECONDS'])
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            for ev in initial:
+                yield format_sse(ev, sub.epoch)
+            while not sub.dropped:
+                seat_hub.maybe_resync(library_id)
+                try:
+                    ev = sub.queue.get(timeout=wait)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(ev, sub.epoch)
+        finally:
+            seat_hub.unsubscribe(library_id, sub)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # 2. Lab List
 @app.route('/libraries/labs', methods=['GET'])
 def lab_list():
-    labs = Library.query.filter_by(type='lab').all()
-    return jsonify([{
-        'library_id': l.library_id,
-        'name': l.name,
-        'location': l.location
-    } for l in labs])
+    def render():
+        labs = Library.query.filter_by(type='lab').all()
+        return [{
+            'library_id': l.library_id,
+            'name': l.name,
+            'location': l.location
+        } for l in labs]
+    return cached_json('labs', render)
+
+# Book covers live in the content-addressed cover_store; responses only carry a URL
+def cover_url(book):
+    if not book.cover_hash:
+        return None
+    return url_for('get_cover', cover_hash=book.cover_hash, _external=True)
+
+@app.route('/books/covers/<string:cover_hash>', methods=['GET'])
+def get_cover(cover_hash):
+    if not cover_store.exists(cover_hash):
+        abort(404)
+    # The hash is the content, so the ETag is strong and the URL never changes meaning
+    resp = send_file(
+        cover_store.path_for(cover_hash),
+        mimetype=cover_store.mimetype(cover_hash),
+        etag=cover_hash,
+        max_age=app.config['COVER_MAX_AGE'],
+        conditional=True
+    )
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+@app.cli.command('migrate-covers')
+@click.option('--batch-size', default=200, show_default=True)
+def migrate_covers(batch_size):
+    """Move inline Book.image blobs into the cover store (run `flask upgrade-db` first)."""
+    if 'cover_hash' not in {c['name'] for c in db.inspect(db.engine).get_columns('book')}:
+        raise click.ClickException('book.cover_hash is missing; run `flask upgrade-db` first')
+
+    moved = 0
+    while True:
+        books = (
+            Book.query
+            .options(db.undefer(Book.image))
+            .filter(Book.image.isnot(None))
+            .order_by(Book.book_id)
+            .limit(batch_size)
+            .all()
+        )
+        if not books:
+            break
+        for b in books:
+            b.cover_hash = cover_store.put(b.image)
+            b.image = None
+        db.session.commit()
+        moved += len(books)
+        click.echo(f'Moved {moved} covers')
+    click.echo(f'Done, {moved} covers moved')
 
 # 3. Book Search
+# Free-text search is served from an in-process inverted index. Each worker keeps its
+# own copy, so it is rebuilt after SEARCH_INDEX_MAX_AGE seconds to pick up writes made
+# by other workers (0 disables the periodic rebuild).
+app.config.setdefault('SEARCH_INDEX_MAX_AGE', int(os.getenv('SEARCH_INDEX_MAX_AGE', '300')))
+book_index = SearchIndex()
+
+def ensure_book_index():
+    if book_index.is_stale(app.config['SEARCH_INDEX_MAX_AGE']):
+        rows = db.session.query(Book.book_id, Book.isbn, Book.title, Book.author) \
+                         .execution_options(yield_per=5000)
+        book_index.rebuild(rows)
+
+def index_book(book):
+    # Only keep a built index in sync; an unbuilt one picks the row up on first search
+    if book_index.built_at is not None:
+        book_index.add(book.book_id, book.isbn, book.title, book.author)
+
+def book_summary(b):
+    return {
+        'book_id':          b.book_id,
+        'isbn':             b.isbn,
+        'title':            b.title,
+        'author':           b.author,
+        'copies_available': b.copies_available,
+        'cover_url':        cover_url(b)
+    }
+
+def books_in_order(book_ids):
+    by_id = {b.book_id: b for b in Book.query.filter(Book.book_id.in_(book_ids))} if book_ids else {}
+    return [by_id[i] for i in book_ids if i in by_id]
+
+def estimated_table_rows(model):
+    # Planner statistics are good enough for "about N results" and cost nothing;
+    # fall back to a real COUNT on other backends or before the first ANALYZE
+    if db.engine.dialect.name == 'postgresql':
+        est = db.session.execute(
+            db.text('SELECT reltuples::bigint FROM pg_class WHERE relname = :t'),
+            {'t': model.__tablename__}
+        ).scalar()
+        if est is not None and est >= 0:
+            return int(est)
+    return db.session.query(func.count()).select_from(model).scalar()
+
 @app.route('/books', methods=['GET'])
 def search_books():
     search_term = request.args.get('q', '').strip()
-    page        = request.args.get('page', 1, type=int)
+
+    # Cursor mode: ?after=<cursor>&limit=N (an empty `after` starts from the top)
+    if 'after' in request.args or 'limit' in request.args:
+        return search_books_cursor(search_term)
+
+    page        = max(request.args.get('page', 1, type=int) or 1, 1)
     per_page    = 10
 
-    qry = Book.query
     if search_term:
-        qry = qry.filter(
-            or_(
-                Book.isbn.ilike(f'%{search_term}%'),
-                Book.title.ilike(f'%{search_term}%'),
-                Book.author.ilike(f'%{search_term}%')
-            )
-        )
+        ensure_book_index()
+        ranked = book_index.search(search_term)
+        total = len(ranked)
+        page_items = books_in_order(ranked[(page - 1) * per_page:page * per_page])
+        pages = (total + per_page - 1) // per_page
+    else:
+        paginated = Book.query.paginate(page=page, per_page=per_page, error_out=False)
+        page_items, total, pages = paginated.items, paginated.total, paginated.pages
 
-    paginated = qry.paginate(page=page, per_page=per_page, error_out=False)
+    return jsonify({
+        'items':    [book_summary(b) for b in page_items],
+        'total':    total,
+        'page':     page,
+        'per_page': per_page,
+        'pages':    pages
+    })
 
-    items = []
-    for b in paginated.items:
-        # base64 encode the binary if present
-        img_b64 = base64.b64encode(b.image).decode('ascii') if b.image else None
+def search_books_cursor(search_term):
+    try:
+        position = decode_cursor(request.args.get('after', ''))
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    want_total = request.args.get('estimate_total', 'false') == 'true'
 
-        items.append({
-            'book_id':          b.book_id,
-            'isbn':             b.isbn,
-            'title':            b.title,
-            'author':           b.author,
-            'copies_available': b.copies_available,
-            'image_base64':     img_b64
-        })
+    total = None
+    if search_term:
+        # The cursor is the last (score, book_id) served, so paging resumes after it
+        # even if the index changes in between
+        ensure_book_index()
+        ranked = book_index.search_scored(search_term)
+        start = 0
+        if position:
+            last_score, last_id = position.get('s'), position.get('id')
+            if not isinstance(last_score, (int, float)) or not isinstance(last_id, int):
+                return jsonify({'error': 'Malformed cursor'}), 400
+            start = bisect_right([(-s, d) for d, s in ranked], (-last_score, last_id))
+        page = ranked[start:start + limit]
+        page_items = books_in_order([d for d, _ in page])
+        next_cursor = encode_cursor({'s': page[-1][1], 'id': page[-1][0]}) \
+            if start + limit < len(ranked) else None
+        total = len(ranked)
+    else:
+        last_id = position.get('id', 0)
+        if not isinstance(last_id, int):
+            return jsonify({'error': 'Malformed cursor'}), 400
+        # Fetch one extra row to know whether another page exists, no COUNT needed
+        rows = (
+            Book.query
+            .filter(Book.book_id > last_id)
+            .order_by(Book.book_id)
+            .limit(limit + 1)
+            .all()
+        )
+        page_items = rows[:limit]
+        next_cursor = encode_cursor({'id': page_items[-1].book_id}) if len(rows) > limit else None
+        if want_total:
+            total = estimated_table_rows(Book)
 
-    return jsonify({
-        'items':    items,
-        'total':    paginated.total,
-        'page':     paginated.page,
-        'per_page': paginated.per_page,
-        'pages':    paginated.pages
-    })
+    body = {
+        'items':       [book_summary(b) for b in page_items],
+        'limit':       limit,
+        'next_cursor': next_cursor
+    }
+    if want_total:
+        body['estimated_total'] = total
+    return jsonify(body)
 
 
 
@@ -542,10 +1788,11 @@ def add_book():
         )
 
         if image_file:
-            new_book.image = image_file.read()
+            new_book.cover_hash = cover_store.put(image_file.read())
 
         db.session.add(new_book)
         db.session.commit()
+        index_book(new_book)
 
         return jsonify({
             'message': 'Book added successfully',
@@ -570,31 +1817,89 @@ def add_book():
             'trace': tb.splitlines()[-5:]   # last 5 lines of traceback
         }), 500
 
+# Bulk catalog import (CSV or JSONL), upserting by ISBN
+app.config.setdefault('IMPORT_BATCH_SIZE', 1000)
+# Server-side directory the import endpoint may read covers from
+app.config.setdefault('IMPORT_COVERS_FOLDER', os.getenv('IMPORT_COVERS_FOLDER'))
+
+def run_book_import(stream, fmt, covers_dir, batch_size, progress=None):
+    importer = BookImporter(
+        db.session, Book.__table__, cover_store,
+        covers_dir=covers_dir, batch_size=batch_size, progress=progress
+    )
+    report = importer.run(iter_records(stream, fmt))
+    # Upserts bypass the ORM, so let the next search rebuild the index
+    book_index.invalidate()
+    return report
+
+@app.route('/books/import', methods=['POST'])
+def import_books():
+    if g.current_user.role != 'staff':
+        raise Forbidden('Only staff can import books')
+
+    # Either a multipart `file` field or the raw request body
+    upload = request.files.get('file')
+    if upload:
+        stream, fmt = upload.stream, detect_format(upload.filename, upload.mimetype)
+    else:
+        stream, fmt = request.stream, detect_format(content_type=request.content_type)
+    fmt = request.args.get('format', fmt)
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': "format must be 'csv' or 'jsonl'"}), 400
+
+    report = run_book_import(stream, fmt, app.config['IMPORT_COVERS_FOLDER'], app.config['IMPORT_BATCH_SIZE'])
+    app.logger.info(f"Book import: {report['processed']} rows, {report['failed']} failed, "
+                    f"{report['rows_per_sec']} rows/sec")
+    return jsonify(report), 200
+
+@app.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--covers-dir', type=click.Path(exists=True, file_okay=False), default=None)
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None)
+@click.option('--batch-size', default=1000, show_default=True)
+def import_books_command(path, covers_dir, fmt, batch_size):
+    """Stream a CSV/JSONL catalog file into the book table."""
+    def progress(r):
+        click.echo(f"{r['processed']} rows, {r['failed']} failed, {r['rows_per_sec']} rows/sec")
+
+    with open(path, 'rb') as f:
+        report = run_book_import(f, fmt or detect_format(path), covers_dir, batch_size, progress)
+    for err in report['errors']:
+        click.echo(f"line {err['line']}: {err['error']}", err=True)
+    click.echo(f"Done: {report['processed']} rows, {report['upserted']} upserted, "
+               f"{report['failed']} failed in {report['elapsed_s']}s ({report['rows_per_sec']} rows/sec)")
+
 @app.route('/books/<int:book_id>/status', methods=['PATCH' , 'OPTIONS'])
 def update_book_status(book_id):
     if request.method == 'OPTIONS':
         return '', 200  # allow preflight CORS request
    
-    book = Book.query.get(book_id)
-    if not book:
-        return jsonify({'error': 'Book not found'}), 404
-    
     action = request.json.get('action')
     
     if action == 'add':
-        book.copies_total += 1
-        book.copies_available += 1
+        counts = inventory.add_copies(db.session, Book.__table__, book_id)
     elif action == 'remove':
-        if book.copies_available > 0:
-            book.copies_available -= 1
-        book.copies_total -= 1
+        counts = inventory.remove_copies(db.session, Book.__table__, book_id)
     else:
         return jsonify({'error': 'Invalid action'}), 400
     
+    if counts is None:
+        db.session.rollback()
+        if not db.session.get(Book, book_id):
+            return jsonify({'error': 'Book not found'}), 404
+        return jsonify({'error': 'No copies to remove'}), 400
+
+    fulfilled = []
+    if action == 'add':
+        fulfilled = fulfil_holds([book_id])
+        if fulfilled:
+            counts = db.session.query(Book.copies_total, Book.copies_available) \
+                               .filter(Book.book_id == book_id).one()
     db.session.commit()
+    publish_hold_updates(fulfilled)
     return jsonify({
-        'copies_total': book.copies_total,
-        'copies_available': book.copies_available
+        'copies_total': counts.copies_total,
+        'copies_available': counts.copies_available
     })
 
 @app.route('/books/<int:book_id>', methods=['PUT', 'OPTIONS'])
@@ -617,10 +1922,11 @@ def update_book(book_id):
     # Optional: update image
     image_file = request.files.get('image')
     if image_file:
-        book.image = image_file.read()
+        book.cover_hash = cover_store.put(image_file.read())
 
     try:
         db.session.commit()
+        index_book(book)
         return jsonify({'message': 'Book updated successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -630,11 +1936,18 @@ def update_book(book_id):
 # 4. Create Reservation
 @app.route('/books/<int:book_id>/reserve', methods=['POST'])
 def reserve_book(book_id):
-    book = Book.query.get_or_404(book_id)
     data = request.get_json()
     
-    
-    if book.copies_available <= 0:
+    # Free copies belong to the wait list first; only then claim one with a
+    # conditional UPDATE, which fails instead of overbooking
+    queued = db.session.query(BookHold.hold_id).filter_by(book_id=book_id, status='waiting').first()
+    if queued or inventory.take_copies(db.session, Book.__table__, book_id) is None:
+        db.session.rollback()
+        if not db.session.get(Book, book_id):
+            abort(404)
+        # {"hold": true} joins the wait list instead of failing
+        if data.get('hold'):
+            return place_hold(book_id, g.current_user.user_id, data.get('library_id', 1))
         return jsonify({'error': 'No available copies'}), 400
     
     # Calculate reservation period (default 2 hours)
@@ -652,23 +1965,95 @@ def reserve_book(book_id):
         reserved_until=reserved_until
     )
     
-    book.copies_available -= 1
     db.session.add(reservation)
+    bump_user_counters(g.current_user.user_id, reservations=1)
     db.session.commit()
+    reservation_sweeper.schedule(reservation.reservation_id, reservation.reserved_until)
     
     return jsonify({
         'reservation_id': reservation.reservation_id,
         'reserved_until': reservation.reserved_until.isoformat()
     }), 201
 
+# Hold queue endpoints
+@app.route('/books/<int:book_id>/holds', methods=['POST'])
+def create_hold(book_id):
+    data = request.get_json(silent=True) or {}
+    if not db.session.get(Book, book_id):
+        abort(404)
+    return place_hold(book_id, g.current_user.user_id, data.get('library_id', 1))
+
+@app.route('/books/<int:book_id>/holds', methods=['GET'])
+def book_hold_queue(book_id):
+    depth = BookHold.query.filter_by(book_id=book_id, status='waiting').count()
+    mine = BookHold.query.filter_by(book_id=book_id, user_id=g.current_user.user_id, status='waiting').first()
+    return jsonify({
+        'book_id':  book_id,
+        'depth':    depth,
+        'my_hold':  serialize_hold(mine, hold_position(mine)) if mine else None
+    })
+
+@app.route('/holds/<int:hold_id>', methods=['GET'])
+def get_hold(hold_id):
+    hold = BookHold.query.get_or_404(hold_id)
+    if hold.user_id != g.current_user.user_id and g.current_user.role != 'staff':
+        raise Forbidden('You can only view your own holds')
+    return jsonify(serialize_hold(hold, hold_position(hold)))
+
+@app.route('/holds/<int:hold_id>', methods=['DELETE'])
+def cancel_hold(hold_id):
+    hold = BookHold.query.get_or_404(hold_id)
+    if hold.user_id != g.current_user.user_id:
+        raise Forbidden('You can only cancel your own holds')
+    if hold.status != 'waiting':
+        return jsonify({'error': 'Hold is not waiting'}), 400
+    hold.status = 'cancelled'
+    db.session.commit()
+    return '', 204
+
+@app.route('/holds/metrics', methods=['GET'])
+def hold_metrics():
+    if g.current_user.role != 'staff':
+        raise Forbidden('Staff only')
+    days = request.args.get('days', 30, type=int)
+
+    depths = (
+        db.session.query(BookHold.book_id, func.count())
+        .filter(BookHold.status == 'waiting')
+        .group_by(BookHold.book_id)
+        .order_by(func.count().desc())
+        .limit(20)
+        .all()
+    )
+    total_waiting = BookHold.query.filter_by(status='waiting').count()
+
+    since = datetime.utcnow() - timedelta(days=days)
+    waits = sorted(
+        (f - c).total_seconds()
+        for c, f in db.session.query(BookHold.created_at, BookHold.fulfilled_at)
+                              .filter(BookHold.status == 'fulfilled', BookHold.fulfilled_at >= since)
+    )
+
+    def pct(p):
+        return round(waits[min(int(len(waits) * p), len(waits) - 1)], 1) if waits else None
+
+    return jsonify({
+        'waiting':         total_waiting,
+        'deepest_queues':  [{'book_id': b, 'depth': n} for b, n in depths],
+        'fulfilled':       len(waits),
+        'time_to_fulfil_seconds': {
+            'mean': round(sum(waits) / len(waits), 1) if waits else None,
+            'p50':  pct(0.5),
+            'p90':  pct(0.9)
+        }
+    })
+
 @app.route('/books/<int:book_id>', methods=['GET'])
 def get_book_by_id(book_id):
     book = Book.query.get(book_id)
     if not book:
         return jsonify({'error': 'Book not found'}), 404
 
-    img_b64 = base64.b64encode(book.image).decode('ascii') if book.image else None
-
     return jsonify({
         'book_id':          book.book_id,
         'isbn':             book.isbn,
@@ -677,9 +2062,160 @@ def get_book_by_id(book_id):
         'publisher':        book.publisher,
         'year':             book.year,
         'copies_available': book.copies_available,
-        'image_base64':     img_b64
+        'cover_url':        cover_url(book)
+    })
+
+
+# Batch lookup so reservation/loan lists resolve their books in one round trip
+BOOK_BATCH_MAX = 500
+
+@app.route('/books/batch', methods=['GET', 'POST'])
+def get_books_batch():
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        raw_ids = data.get('book_ids') or []
+        isbns = data.get('isbns') or []
+        include_covers = bool(data.get('include_covers', False))
+    else:
+        raw_ids = [x for x in request.args.get('ids', '').split(',') if x.strip()]
+        isbns = [x for x in request.args.get('isbns', '').split(',') if x.strip()]
+        include_covers = request.args.get('include_covers', 'false') == 'true'
+
+    if not isinstance(raw_ids, list) or not isinstance(isbns, list):
+        return jsonify({'error': 'book_ids and isbns must be lists'}), 400
+    try:
+        book_ids = {int(i) for i in raw_ids}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'book_ids must be integers'}), 400
+    isbns = {str(i).strip() for i in isbns if str(i).strip()}
+
+    if not book_ids and not isbns:
+        return jsonify({'error': 'Provide book_ids and/or isbns'}), 400
+    if len(book_ids) + len(isbns) > BOOK_BATCH_MAX:
+        return jsonify({'error': f'At most {BOOK_BATCH_MAX} ids/isbns per request'}), 400
+
+    conds = []
+    if book_ids:
+        conds.append(Book.book_id.in_(book_ids))
+    if isbns:
+        conds.append(Book.isbn.in_(isbns))
+    books = (
+        Book.query
+        .options(db.load_only(Book.book_id, Book.isbn, Book.title, Book.author,
+                              Book.copies_available, Book.cover_hash))
+        .filter(or_(*conds))
+        .all()
+    )
+
+    result = {}
+    for b in books:
+        entry = {
+            'isbn':             b.isbn,
+            'title':            b.title,
+            'author':           b.author,
+            'copies_available': b.copies_available
+        }
+        if include_covers:
+            entry['cover_url'] = cover_url(b)
+        result[str(b.book_id)] = entry
+
+    found_ids = {b.book_id for b in books}
+    found_isbns = {b.isbn: b.book_id for b in books if b.isbn in isbns}
+    return jsonify({
+        'books':   result,
+        'isbns':   found_isbns,
+        'missing': {
+            'book_ids': sorted(book_ids - found_ids),
+            'isbns':    sorted(isbns - set(found_isbns))
+        }
+    })
+
+# --- List endpoints: filters, keyset pages and NDJSON streaming ---
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 500
+
+def date_range_args():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD (both inclusive); raises ValueError."""
+    bounds = []
+    for name in ('from', 'to'):
+        raw = request.args.get(name)
+        try:
+            bounds.append(date.fromisoformat(raw) if raw else None)
+        except ValueError:
+            raise ValueError(f"'{name}' must be YYYY-MM-DD")
+    return bounds
+
+def keyset_list(query, key_col, serialize):
+    """
+    Serve a list query as one keyset page ({'items', 'next_cursor'}) when ?after= or
+    ?limit= is given, or, with ?format=ndjson, as a stream of one JSON object per line
+    fetched with yield_per. Otherwise it is the original unpaged {'items'} list.
+    """
+    if request.args.get('format') == 'ndjson':
+        # Plain rows rather than ORM objects: nothing to track, and yield_per can't be uniqued
+        rows = (
+            query.with_entities(*key_col.class_.__table__.columns)
+            .order_by(key_col)
+            .execution_options(yield_per=1000)
+        )
+
+        def generate():
+            for row in rows:
+                yield json.dumps(serialize(row)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if 'after' not in request.args and 'limit' not in request.args:
+        return jsonify({'items': [serialize(r) for r in query.order_by(key_col).all()]})
+
+    try:
+        position = decode_cursor(request.args.get('after', ''))
+        limit = parse_limit(request.args.get('limit'), default=LIST_DEFAULT_LIMIT, maximum=LIST_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    last_key = position.get('id', 0)
+    if not isinstance(last_key, int):
+        return jsonify({'error': 'Malformed cursor'}), 400
+
+    rows = query.filter(key_col > last_key).order_by(key_col).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = encode_cursor({'id': getattr(page[-1], key_col.key)}) if len(rows) > limit else None
+    return jsonify({
+        'items':       [serialize(r) for r in page],
+        'next_cursor': next_cursor
     })
 
+def serialize_reservation(r):
+    return {
+        'reservation_id': r.reservation_id,
+        'book_id':        r.book_id,
+        'user_id':        r.user_id,
+        'reserved_from':  r.reserved_from.isoformat(),
+        'reserved_until': r.reserved_until.isoformat(),
+        'status':         r.status
+    }
+
+def serialize_loan(l):
+    return {
+        'loan_id':       l.loan_id,
+        'book_id':       l.book_id,
+        'user_id':       l.user_id,
+        'checkout_date': l.checkout_date.isoformat(),
+        'due_date':      l.due_date.isoformat() if l.due_date else None,
+        'returned_date': l.returned_date.isoformat() if l.returned_date else None
+    }
+
+def filter_reservations(query):
+    statuses = [x for x in request.args.get('status', '').split(',') if x]
+    if any(x not in ('active', 'cancelled', 'fulfilled') for x in statuses):
+        raise ValueError("status must be 'active', 'cancelled' or 'fulfilled' (comma separated)")
+    if statuses:
+        query = query.filter(Reservation.status.in_(statuses))
+    start, end = date_range_args()
+    if start:
+        query = query.filter(Reservation.reserved_from >= datetime.combine(start, time.min))
+    if end:
+        query = query.filter(Reservation.reserved_from < datetime.combine(end + timedelta(days=1), time.min))
+    return query
 
 # GET /reservations
 @app.route('/reservations', methods=['GET', 'OPTIONS'])
@@ -692,19 +2228,12 @@ def get_reservations():
         query = query.filter_by(user_id=user_id)
     if book_id:
         query = query.filter_by(book_id=book_id)
+    try:
+        query = filter_reservations(query)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    reservations = query.all()
-    
-    return jsonify({
-        'items': [{
-            'reservation_id': r.reservation_id,
-            'book_id': r.book_id,
-            'user_id': r.user_id,
-            'reserved_from': r.reserved_from.isoformat(),
-            'reserved_until': r.reserved_until.isoformat(),
-            'status': r.status
-        } for r in reservations]
-    })
+    return keyset_list(query, Reservation.reservation_id, serialize_reservation)
 
 @app.route('/users/<string:firebase_uid>/reservations', methods=['GET', 'OPTIONS'])
 def get_user_reservations(firebase_uid):
@@ -722,19 +2251,15 @@ def get_user_reservations(firebase_uid):
     query = Reservation.query.filter_by(user_id=user.user_id)
     if book_id is not None:
         query = query.filter_by(book_id=book_id)
+    try:
+        query = filter_reservations(query)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    items = [{
-        'reservation_id': r.reservation_id,
-        'book_id':        r.book_id,
-        'user_id':        r.user_id,
-        'reserved_from':  r.reserved_from.isoformat(),
-        'reserved_until': r.reserved_until.isoformat(),
-        'status':         r.status,
-        
-    } for r in query.all()]
+    return keyset_list(query, Reservation.reservation_id, serialize_reservation)
 
-    return jsonify({'items': items}), 200
 
+LOAN_PERIOD_DAYS = 5
 
 @app.route('/reservations/<int:reservation_id>/collect', methods=['POST'])
 def collect_reservation(reservation_id):
@@ -744,9 +2269,18 @@ def collect_reservation(reservation_id):
     if reservation.user_id != g.current_user.user_id:
         raise Forbidden("You can only collect your own reservations")
     
-    # Validate reservation status
-    if reservation.status != 'active':
-        return jsonify({'error': 'Reservation is not active'}), 400
+    # Claim it with one conditional UPDATE, so a concurrent expiry sweep (which
+    # gives the copy back) and a collect can't both win
+    claimed = db.session.execute(
+        update(Reservation.__table__)
+        .where(Reservation.reservation_id == reservation_id,
+               Reservation.status == 'active',
+               Reservation.reserved_until > datetime.utcnow())
+        .values(status='fulfilled')
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return jsonify({'error': 'Reservation is not active or has expired'}), 400
     
     # Create loan with 5-day default period
     today = date.today()
@@ -754,14 +2288,12 @@ def collect_reservation(reservation_id):
         user_id=reservation.user_id,
         book_id=reservation.book_id,
         checkout_date=today,
-        due_date=today + timedelta(days=5)
+        due_date=today + timedelta(days=LOAN_PERIOD_DAYS)
     )
     
-    # Update reservation status
-    reservation.status = 'fulfilled'
-    
     # Commit changes
     db.session.add(loan)
+    bump_user_counters(reservation.user_id, reservations=-1, loans=1)
     db.session.commit()
     
     return jsonify({
@@ -772,51 +2304,310 @@ def collect_reservation(reservation_id):
 @app.route('/reservations/<int:reservation_id>', methods=['DELETE'])
 def delete_reservation(reservation_id):
     reservation = Reservation.query.get_or_404(reservation_id)
-    book = Book.query.get(reservation.book_id)
     
-    # Increase book availability
-    book.copies_available += 1
+    # Only an active reservation is still holding a copy
+    fulfilled = []
+    if reservation.status == 'active':
+        inventory.release_copies(db.session, Book.__table__, reservation.book_id)
+        bump_user_counters(reservation.user_id, reservations=-1)
+        fulfilled = fulfil_holds([reservation.book_id])
     
+    # A hold may point at this reservation
+    BookHold.query.filter_by(reservation_id=reservation_id).update({'reservation_id': None})
     db.session.delete(reservation)
     db.session.commit()
+    publish_hold_updates(fulfilled)
     
     return jsonify({'message': 'Reservation cancelled successfully'}), 200
 
+# Circulation desk: many checkouts/returns for one patron in one transaction
+CIRCULATION_MAX_ITEMS = 200
+
+@app.route('/circulation', methods=['POST'])
+def circulation_batch():
+    """
+    Body: {"user_id": 5 | "firebase_uid": "...",
+           "items": [{"action": "checkout" | "return", "book_id": 1 | "isbn": "..."}, ...]}
+    Returns go first (so their copies can serve holds), then checkouts; a checkout
+    first fulfils the patron's own active reservation for that book, otherwise it
+    takes a free copy. The number of queries does not grow with the batch size.
+    """
+    if g.current_user.role != 'staff':
+        raise Forbidden('Only staff can run circulation')
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    items = data.get('items') or []
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > CIRCULATION_MAX_ITEMS:
+        return jsonify({'error': f'At most {CIRCULATION_MAX_ITEMS} items per request'}), 400
+
+    if data.get('user_id'):
+        patron = db.session.get(User, data['user_id'])
+    else:
+        patron = User.query.filter_by(firebase_uid=data.get('firebase_uid')).first()
+    if not patron:
+        return jsonify({'error': 'Patron not found'}), 404
+
+    # 1) Resolve every scan with one query; an item that isn't an object fails on its own
+    malformed = {i for i, it in enumerate(items) if not isinstance(it, dict)}
+    items = [{} if i in malformed else it for i, it in enumerate(items)]
+    results = [{'index': i, 'action': it.get('action')} for i, it in enumerate(items)]
+    ids, isbns = set(), set()
+    for it in items:
+        if it.get('book_id') is not None:
+            try:
+                ids.add(int(it['book_id']))
+            except (TypeError, ValueError):
+                pass
+        elif it.get('isbn'):
+            isbns.add(str(it['isbn']).strip())
+    conds = []
+    if ids:
+        conds.append(Book.book_id.in_(ids))
+    if isbns:
+        conds.append(Book.isbn.in_(isbns))
+    books = db.session.query(Book.book_id, Book.isbn).filter(or_(*conds)).all() if conds else []
+    by_id = {b.book_id: b.book_id for b in books}
+    by_isbn = {b.isbn: b.book_id for b in books}
+
+    checkouts, returns = [], []
+    for res, it in zip(results, items):
+        try:
+            book_id = by_id.get(int(it['book_id'])) if it.get('book_id') is not None \
+                else by_isbn.get(str(it.get('isbn') or '').strip())
+        except (TypeError, ValueError):
+            book_id = None
+        res['book_id'] = book_id
+        if res['index'] in malformed:
+            res.update(status='error', error='Each item must be an object')
+        elif res['action'] not in ('checkout', 'return'):
+            res.update(status='error', error="action must be 'checkout' or 'return'")
+        elif book_id is None:
+            res.update(status='error', error='Book not found')
+        else:
+            (checkouts if res['action'] == 'checkout' else returns).append(res)
+
+    today = date.today()
+    loan_delta = 0
+    reservation_delta = 0
+
+    # 2) Returns: match the patron's open loans (oldest first) and close them in one UPDATE
+    returned_books = Counter()
+    if returns:
+        open_loans = {}
+        for loan in (
+            db.session.query(Loan.loan_id, Loan.book_id)
+            .filter(Loan.user_id == patron.user_id, Loan.returned_date.is_(None),
+                    Loan.book_id.in_({r['book_id'] for r in returns}))
+            .order_by(Loan.loan_id)
+        ):
+            open_loans.setdefault(loan.book_id, []).append(loan.loan_id)
+        closing = []
+        for res in returns:
+            pending = open_loans.get(res['book_id'])
+            if not pending:
+                res.update(status='error', error='No open loan for this book')
+                continue
+            loan_id = pending.pop(0)
+            closing.append(loan_id)
+            returned_books[res['book_id']] += 1
+            res.update(status='ok', loan_id=loan_id, returned_date=today.isoformat())
+        if closing:
+            db.session.execute(
+                update(Loan.__table__).where(Loan.loan_id.in_(closing)).values(returned_date=today)
+            )
+            inventory.release_many(db.session, Book.__table__, returned_books)
+            loan_delta -= len(closing)
+
+    # Freed copies go to waiting holds before new checkouts
+    held = {
+        b for (b,) in db.session.query(BookHold.book_id)
+        .filter(BookHold.book_id.in_(list(returned_books)), BookHold.status == 'waiting')
+        .distinct()
+    } if returned_books else set()
+    fulfilled = fulfil_holds(held)
+
+    # 3) Checkouts: use the patron's own active reservations first, then free copies
+    new_loans = []
+    if checkouts:
+        own = {}
+        for r in (
+            Reservation.query
+            .filter(Reservation.user_id == patron.user_id, Reservation.status == 'active',
+                    Reservation.book_id.in_({c['book_id'] for c in checkouts}))
+            .order_by(Reservation.reservation_id)
+            # Locked so the expiry sweeper can't cancel (and release) one we are fulfilling
+            .with_for_update()
+        ):
+            own.setdefault(r.book_id, []).append(r)
+        need = Counter()
+        for res in checkouts:
+            pending = own.get(res['book_id'])
+            if pending:
+                reservation = pending.pop(0)
+                reservation.status = 'fulfilled'
+                reservation_delta -= 1
+                res['reservation_id'] = reservation.reservation_id
+            else:
+                need[res['book_id']] += 1
+        # Two scans of a title with one copy left: the first gets it, the second fails
+        taken = inventory.take_up_to(db.session, Book.__table__, need)
+        for res in checkouts:
+            if 'reservation_id' not in res:
+                if not taken.get(res['book_id']):
+                    res.update(status='error', error='No available copies')
+                    continue
+                taken[res['book_id']] -= 1
+            loan = Loan(user_id=patron.user_id, book_id=res['book_id'], checkout_date=today,
+                        due_date=today + timedelta(days=LOAN_PERIOD_DAYS))
+            new_loans.append((res, loan))
+        db.session.add_all([loan for _, loan in new_loans])
+        db.session.flush()
+        for res, loan in new_loans:
+            res.update(status='ok', loan_id=loan.loan_id, due_date=loan.due_date.isoformat())
+        loan_delta += len(new_loans)
+
+    bump_user_counters(patron.user_id, reservations=reservation_delta, loans=loan_delta)
+    db.session.commit()
+    publish_hold_updates(fulfilled)
+
+    return jsonify({
+        'user_id':     patron.user_id,
+        'checked_out': sum(1 for r in results if r['action'] == 'checkout' and r.get('status') == 'ok'),
+        'returned':    sum(1 for r in results if r['action'] == 'return' and r.get('status') == 'ok'),
+        'failed':      sum(1 for r in results if r.get('status') == 'error'),
+        'items':       results
+    })
+
 # GET /loans
 @app.route('/loans', methods=['GET'])
 def get_loans():
     user_id = request.args.get('user_id', type=int)
     book_id = request.args.get('book_id', type=int)
+    status  = request.args.get('status')
     
     query = Loan.query
     if user_id:
         query = query.filter_by(user_id=user_id)
     if book_id:
         query = query.filter_by(book_id=book_id)
+
+    if status == 'open':
+        query = query.filter(Loan.returned_date.is_(None))
+    elif status == 'returned':
+        query = query.filter(Loan.returned_date.isnot(None))
+    elif status == 'overdue':
+        query = query.filter(Loan.returned_date.is_(None), Loan.due_date < date.today())
+    elif status:
+        return jsonify({'error': "status must be 'open', 'returned' or 'overdue'"}), 400
+
+    try:
+        start, end = date_range_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start:
+        query = query.filter(Loan.checkout_date >= start)
+    if end:
+        query = query.filter(Loan.checkout_date <= end)
     
-    loans = query.all()
-    
-    return jsonify({
-        'items': [{
-            'loan_id': l.loan_id,
-            'book_id': l.book_id,
-            'user_id': l.user_id,
-            'checkout_date': l.checkout_date.isoformat(),
-            'due_date':       l.due_date.isoformat() if l.due_date else None, 
-            'returned_date': l.returned_date.isoformat() if l.returned_date else None
-        } for l in loans]
-    })
+    return keyset_list(query, Loan.loan_id, serialize_loan)
 
 # fee calculation
+app.config.setdefault('FEE_DAILY_RATE', os.getenv('FEE_DAILY_RATE', '5.00'))  # R5 per day
+
+def overdue_amount(due_date, today, rate):
+    days_overdue = (today - due_date).days
+    if days_overdue <= 0:
+        return Decimal('0.00'), 0
+    return (Decimal(days_overdue) * rate).quantize(Decimal('0.01')), days_overdue
+
 def calculate_fees(loan):
    
     if loan.returned_date:
         return 0.0
-    today = date.today()
-    if today > loan.due_date:
-        days_overdue = (today - loan.due_date).days
-        return round(days_overdue * 5.00, 2)  # R5 per day
-    return 0.0
+    amount, _ = overdue_amount(loan.due_date, date.today(), Decimal(str(app.config['FEE_DAILY_RATE'])))
+    return float(amount)
+
+def _days_late(dialect, today, due):
+    """SQL for the whole days between `due` and the date `today`, per dialect."""
+    if dialect == 'sqlite':
+        return cast(func.julianday(today) - func.julianday(due), Integer)
+    if dialect in ('mysql', 'mariadb'):
+        return func.datediff(today, due)
+    return cast(today - due, Integer)
+
+def accrue_overdue_fees(today=None):
+    """
+    Bring the per-loan overdue FeeFine rows up to date with a few set-based statements:
+    one INSERT ... SELECT for newly overdue loans, one UPDATE ... FROM for unpaid fees
+    and one DELETE for unpaid fees of loans no longer overdue (e.g. renewed). Only fees
+    with accrued_through before `today` are touched, so re-running on the same day is a
+    no-op. Paid fees and returned loans are left alone.
+    """
+    today = today or date.today()
+    rate = Decimal(str(app.config['FEE_DAILY_RATE']))
+    loan, fee = Loan.__table__, FeeFine.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    on = literal(today, Date)
+    days = _days_late(dialect, on, loan.c.due_date)
+    amount = cast(days * literal(rate, Numeric(8, 2)), Numeric(8, 2))
+    description = (literal('Overdue fee: ') + cast(days, String) + literal(' day(s) late (loan #')
+                   + cast(loan.c.loan_id, String) + literal(')'))
+    is_open = loan.c.returned_date.is_(None)
+    overdue = loan.c.due_date < on
+    stale = or_(fee.c.accrued_through.is_(None), fee.c.accrued_through < on)
+    unpaid = literal('unpaid')
+    if dialect == 'postgresql':
+        # A bare string in a SELECT list is text there, which won't assign to the enum
+        unpaid = cast(unpaid, fee.c.status.type)
+
+    # Counter deltas for everything the three statements below change, in one grouped read
+    deltas = db.session.execute(
+        select(loan.c.user_id,
+               func.sum(case((overdue, amount), else_=0) - func.coalesce(fee.c.amount, 0)))
+        .select_from(loan.outerjoin(fee, fee.c.loan_id == loan.c.loan_id))
+        .where(is_open, or_(and_(fee.c.feefine_id.is_(None), overdue),
+                            and_(fee.c.status == 'unpaid', stale)))
+        .group_by(loan.c.user_id)
+    ).all()
+
+    removed = db.session.execute(
+        fee.delete().where(
+            fee.c.status == 'unpaid', stale,
+            fee.c.loan_id.in_(select(loan.c.loan_id).where(is_open, loan.c.due_date >= on)))
+    ).rowcount
+    updated = db.session.execute(
+        update(fee)
+        .where(fee.c.loan_id == loan.c.loan_id, fee.c.status == 'unpaid', stale, is_open, overdue)
+        .values(amount=amount, description=description, accrued_through=on)
+    ).rowcount
+    created = db.session.execute(
+        fee.insert().from_select(
+            ['user_id', 'loan_id', 'amount', 'description', 'status', 'created_at', 'accrued_through'],
+            select(loan.c.user_id, loan.c.loan_id, amount, description,
+                   unpaid, literal(datetime.utcnow(), DateTime), on)
+            .where(is_open, overdue,
+                   ~select(fee.c.feefine_id).where(fee.c.loan_id == loan.c.loan_id).exists()))
+    ).rowcount
+
+    apply_counter_deltas({u: (0, 0, _money(d)) for u, d in deltas})
+    db.session.commit()
+    return {'created': created, 'updated': updated, 'removed': removed}
+
+@app.cli.command('accrue-fees')
+@click.option('--date', 'on_date', default=None, help='Accrue as of YYYY-MM-DD (default today)')
+def accrue_fees_command(on_date):
+    """Daily overdue-fee accrual; schedule it from cron."""
+    today = date.fromisoformat(on_date) if on_date else None
+    started = datetime.utcnow()
+    result = accrue_overdue_fees(today)
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    click.echo(f"{result['created']} fees created, {result['updated']} updated, "
+               f"{result['removed']} removed in {elapsed:.2f}s")
 
 # PUT /feefine/<int:fee_id>/pay
 @app.route('/feefine/<int:fee_id>/pay', methods=['PUT'])
@@ -827,6 +2618,7 @@ def pay_fee(fee_id):
         return jsonify({'error': 'Fee already paid'}), 400
         
     fee.status = 'paid'
+    bump_user_counters(fee.user_id, fees=-fee.amount)
     db.session.commit()
     
     return jsonify({'message': 'Fee paid successfully'}), 200
@@ -926,22 +2718,87 @@ def create_purchase_request():
     }), 201
 
 # 9. Announcements
-@app.route('/announcements', methods=['GET'])
-def get_announcements():
-    active_only = request.args.get('active', 'true') == 'true'
-    limit = request.args.get('limit', 5, type=int)
-    
-    query = Announcement.query.order_by(Announcement.posted_at.desc())
-    if active_only:
-        query = query.filter_by(is_active=True)
-    
-    announcements = query.limit(limit).all()
-    return jsonify([{
+# Rendered feeds are cached until an announcement is created or deleted. Deletes are
+# soft: the row stays as a tombstone for ANNOUNCEMENT_TOMBSTONE_DAYS so ?since= clients
+# learn about removals; a cursor older than that gets "reset" and should refetch.
+app.config.setdefault('ANNOUNCEMENT_TOMBSTONE_DAYS', int(os.getenv('ANNOUNCEMENT_TOMBSTONE_DAYS', '90')))
+ANNOUNCEMENT_FEED_MAX = 200
+announcement_cache = VersionedCache(ttl=app.config['READ_CACHE_TTL'])
+
+def serialize_announcement(a):
+    return {
         'id': a.announcement_id,
         'title': a.title,
         'body': a.body,
         'posted_at': a.posted_at.isoformat()
-    } for a in announcements])
+    }
+
+def announcement_changes(since):
+    """
+    Feed since a cursor: an announcement_id (newer than that announcement) or an ISO
+    posted_at. Returns new active announcements, newest first, and tombstones of
+    announcements deleted after the cursor's posted_at.
+    """
+    since_id = None
+    if since.isdigit():
+        since_id = int(since)
+        anchor = db.session.query(Announcement.posted_at).filter_by(announcement_id=since_id).scalar()
+    else:
+        anchor = as_naive_utc(datetime.fromisoformat(since.replace('Z', '+00:00')))
+    horizon = datetime.utcnow() - timedelta(days=app.config['ANNOUNCEMENT_TOMBSTONE_DAYS'])
+    if anchor is None or anchor < horizon:
+        return {'reset': True, 'items': [], 'deleted': [], 'since': since}
+
+    newer = Announcement.posted_at > anchor
+    if since_id is not None:
+        newer = or_(newer, and_(Announcement.posted_at == anchor, Announcement.announcement_id > since_id))
+    items = (
+        Announcement.query
+        .filter(Announcement.is_active == True, newer)
+        .order_by(Announcement.posted_at.desc(), Announcement.announcement_id.desc())
+        .limit(ANNOUNCEMENT_FEED_MAX + 1)
+        .all()
+    )
+    if len(items) > ANNOUNCEMENT_FEED_MAX:
+        return {'reset': True, 'items': [], 'deleted': [], 'since': since}
+    deleted = (
+        db.session.query(Announcement.announcement_id, Announcement.deleted_at)
+        .filter(Announcement.deleted_at > anchor)
+        .order_by(Announcement.deleted_at)
+        .all()
+    )
+    return {
+        'reset': False,
+        'items': [serialize_announcement(a) for a in items],
+        'deleted': [{'id': d.announcement_id, 'deleted_at': d.deleted_at.isoformat()} for d in deleted],
+        # pass back as ?since= next time
+        'since': str(items[0].announcement_id) if items else since
+    }
+
+@app.route('/announcements', methods=['GET'])
+def get_announcements():
+    since = request.args.get('since')
+    if since:
+        if not since.isdigit():
+            try:
+                datetime.fromisoformat(since.replace('Z', '+00:00'))
+            except ValueError:
+                return jsonify({'error': "'since' must be an announcement id or an ISO 8601 posted_at"}), 400
+        return cached_json(('since', since), lambda: announcement_changes(since), cache=announcement_cache)
+
+    active_only = request.args.get('active', 'true') == 'true'
+    limit = request.args.get('limit', 5, type=int)
+
+    def render():
+        query = (
+            Announcement.query
+            .filter(Announcement.deleted_at.is_(None))
+            .order_by(Announcement.posted_at.desc())
+        )
+        if active_only:
+            query = query.filter_by(is_active=True)
+        return [serialize_announcement(a) for a in query.limit(limit).all()]
+    return cached_json(('latest', active_only, limit), render, cache=announcement_cache)
 
 @app.route('/announcements', methods=['POST'])
 def create_announcement():
@@ -959,36 +2816,33 @@ def create_announcement():
     )
     db.session.add(ann)
     db.session.commit()
-    return jsonify({
-        'id': ann.announcement_id,
-        'title': ann.title,
-        'body':  ann.body,
-        'posted_at': ann.posted_at.isoformat()
-    }), 201
+    announcement_cache.bump()
+    return jsonify(serialize_announcement(ann)), 201
 
-# “Soft” delete or fully remove?
+# Soft delete: the row becomes a tombstone; expired tombstones are purged here
 @app.route('/announcements/<int:ann_id>', methods=['DELETE'])
 def delete_announcement(ann_id):
     ann = Announcement.query.get_or_404(ann_id)
-    # Option A: soft‑delete
-    # ann.is_active = False
-    # db.session.commit()
-    # return '', 204
-
-    # Option B: hard‑delete
-    db.session.delete(ann)
+    if ann.deleted_at is None:
+        ann.is_active = False
+        ann.deleted_at = datetime.utcnow()
+    horizon = datetime.utcnow() - timedelta(days=app.config['ANNOUNCEMENT_TOMBSTONE_DAYS'])
+    Announcement.query.filter(Announcement.deleted_at < horizon).delete(synchronize_session=False)
     db.session.commit()
+    announcement_cache.bump()
     return '', 204
 
 # 10. Library Hours
 @app.route('/libraries/<int:library_id>/hours', methods=['GET'])
 def get_hours(library_id):
-    times = OperatingTime.query.filter_by(library_id=library_id).all()
-    return jsonify([{
-        'weekday': t.weekday,
-        'open_time': t.open_time.strftime('%H:%M'),
-        'close_time': t.close_time.strftime('%H:%M')
-    } for t in times])
+    def render():
+        times = OperatingTime.query.filter_by(library_id=library_id).all()
+        return [{
+            'weekday': t.weekday,
+            'open_time': t.open_time.strftime('%H:%M'),
+            'close_time': t.close_time.strftime('%H:%M')
+        } for t in times]
+    return cached_json(('hours', library_id), render)
 
 @app.route('/libraries/<int:library_id>/hours/<string:weekday>', methods=['PUT'])
 def update_hours(library_id, weekday):
@@ -1029,6 +2883,7 @@ def update_hours(library_id, weekday):
         db.session.add(entry)
 
     db.session.commit()
+    read_cache.bump()
 
     return jsonify({
         'library_id': entry.library_id,
@@ -1044,6 +2899,7 @@ def bulk_update_hours(library_id):
     payload = request.get_json() or {}
     # payload should be a dict: { "Mon": {open_time:"08:00", close_time:"20:00"}, ... }
     updated = []
+    existing = {e.weekday: e for e in OperatingTime.query.filter_by(library_id=library_id)}
     for weekday, times in payload.items():
         if weekday not in ('Mon','Tue','Wed','Thu','Fri','Sat','Sun'):
             continue
@@ -1056,15 +2912,12 @@ def bulk_update_hours(library_id):
         except ValueError:
             continue
 
-        entry = OperatingTime.query.filter_by(
-            library_id=library_id,
-            weekday=weekday
-        ).first()
+        entry = existing.get(weekday)
         if entry:
             entry.open_time = ot
             entry.close_time = ct
         else:
-            entry = OperatingTime(
+            entry = existing[weekday] = OperatingTime(
                 library_id=library_id,
                 weekday=weekday,
                 open_time=ot,
@@ -1074,6 +2927,7 @@ def bulk_update_hours(library_id):
         updated.append(entry)
 
     db.session.commit()
+    read_cache.bump()
 
     return jsonify([{
         'weekday': e.weekday,
@@ -1081,6 +2935,158 @@ def bulk_update_hours(library_id):
         'close_time': e.close_time.strftime('%H:%M')
     } for e in updated]), 200
 
+def serialize_hours_exception(e):
+    return {
+        'date': e.date.isoformat(),
+        'closed': e.open_time is None,
+        'open_time': e.open_time.strftime('%H:%M') if e.open_time else None,
+        'close_time': e.close_time.strftime('%H:%M') if e.close_time else None,
+        'note': e.note
+    }
+
+@app.route('/libraries/<int:library_id>/hours/exceptions', methods=['GET'])
+def get_hours_exceptions(library_id):
+    def render():
+        rows = (
+            LibraryHoursException.query
+            .filter(LibraryHoursException.library_id == library_id,
+                    LibraryHoursException.date >= date.today() - timedelta(days=1))
+            .order_by(LibraryHoursException.date)
+            .all()
+        )
+        return [serialize_hours_exception(e) for e in rows]
+    return cached_json(('hours_exceptions', library_id), render)
+
+# Staff: holiday closure ({"closed": true}) or special hours ({"open_time", "close_time"}) for one date
+@app.route('/libraries/<int:library_id>/hours/exceptions/<string:on_date>', methods=['PUT', 'DELETE'])
+def set_hours_exception(library_id, on_date):
+    if g.current_user.role != 'staff':
+        raise Forbidden('Only staff can change opening hours')
+    try:
+        day = date.fromisoformat(on_date)
+    except ValueError:
+        return jsonify({'error': 'Date must be YYYY-MM-DD'}), 400
+    entry = LibraryHoursException.query.filter_by(library_id=library_id, date=day).first()
+
+    if request.method == 'DELETE':
+        if entry:
+            db.session.delete(entry)
+            db.session.commit()
+            read_cache.bump()
+        return '', 204
+
+    data = request.get_json() or {}
+    open_t = close_t = None
+    if not data.get('closed'):
+        try:
+            open_t = datetime.strptime(data['open_time'], '%H:%M').time()
+            close_t = datetime.strptime(data['close_time'], '%H:%M').time()
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': "Send 'closed': true or 'open_time'/'close_time' as HH:MM"}), 400
+    if db.session.get(Library, library_id) is None:
+        return jsonify({'error': 'Library not found'}), 404
+    if entry is None:
+        entry = LibraryHoursException(library_id=library_id, date=day)
+        db.session.add(entry)
+    entry.open_time, entry.close_time = open_t, close_t
+    entry.note = data.get('note')
+    db.session.commit()
+    read_cache.bump()
+    return jsonify(serialize_hours_exception(entry)), 200
+
+# Compiled weekly schedules for every library, rebuilt when read_cache's version moves
+# (every hours writer bumps it) or after READ_CACHE_TTL
+app.config.setdefault('LIBRARY_TIMEZONE', os.getenv('LIBRARY_TIMEZONE', 'UTC'))
+_schedule_table = {'version': None, 'built_at': None, 'libraries': {}}
+_schedule_lock = threading.Lock()
+
+def library_zone(name):
+    try:
+        return ZoneInfo(name or app.config['LIBRARY_TIMEZONE'])
+    except Exception:
+        app.logger.warning(f'Unknown time zone {name!r}, using UTC')
+        return timezone.utc
+
+def library_schedules():
+    """{library_id: (LibrarySchedule, tzinfo)}"""
+    table = _schedule_table
+    now = datetime.utcnow()
+    if (table['version'] == read_cache.version and table['built_at'] is not None
+            and (now - table['built_at']).total_seconds() < app.config['READ_CACHE_TTL']):
+        return table['libraries']
+    with _schedule_lock:
+        version = read_cache.version
+        weekly, exceptions = {}, {}
+        for t in OperatingTime.query:
+            weekly.setdefault(t.library_id, {}).setdefault(t.weekday, []).append((t.open_time, t.close_time))
+        for e in LibraryHoursException.query.filter(LibraryHoursException.date >= date.today() - timedelta(days=2)):
+            spans = [(e.open_time, e.close_time)] if e.open_time and e.close_time else []
+            exceptions.setdefault(e.library_id, {})[e.date] = spans
+        libraries = {
+            l.library_id: (LibrarySchedule(weekly.get(l.library_id, {}), exceptions.get(l.library_id)),
+                           library_zone(l.timezone))
+            for l in db.session.query(Library.library_id, Library.timezone)
+        }
+        table.update(version=version, built_at=now, libraries=libraries)
+    return libraries
+
+# Open now / closes at / next opening for ?library_id=1,2 (default all) at ?at= (default now)
+@app.route('/libraries/schedule', methods=['GET'])
+def library_schedule_status():
+    raw_ids = request.args.get('library_id')
+    try:
+        wanted = [int(x) for x in raw_ids.split(',') if x.strip()] if raw_ids else None
+    except ValueError:
+        return jsonify({'error': 'library_id must be a comma-separated list of ids'}), 400
+    try:
+        at = datetime.fromisoformat(request.args['at'].replace('Z', '+00:00')) if request.args.get('at') \
+            else datetime.now(timezone.utc)
+    except ValueError:
+        return jsonify({'error': "'at' must be an ISO 8601 datetime"}), 400
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+
+    schedules = library_schedules()
+    out = []
+    for library_id in (wanted if wanted is not None else sorted(schedules)):
+        entry = schedules.get(library_id)
+        if entry is None:
+            out.append({'library_id': library_id, 'error': 'Library not found'})
+            continue
+        schedule, zone = entry
+        local = at.astimezone(zone).replace(tzinfo=None)
+        is_open, closes_at, next_opening = schedule.status(local)
+        out.append({
+            'library_id': library_id,
+            'timezone': str(zone),
+            'open': is_open,
+            'closes_at': closes_at.replace(tzinfo=zone).isoformat() if closes_at else None,
+            'next_opening': next_opening.replace(tzinfo=zone).isoformat() if next_opening else None
+        })
+    return jsonify({'at': at.isoformat(), 'libraries': out})
+
+# Appointments are checked against opening hours and the librarian's other
+# appointments with IntervalSets; the overlap query uses ix_appointment_librarian_start
+APPOINTMENT_SLOT_MAX_DAYS = 31
+
+def library_hours(library_id):
+    hours = {}
+    for t in OperatingTime.query.filter_by(library_id=library_id):
+        hours.setdefault(t.weekday, []).append((t.open_time, t.close_time))
+    return hours
+
+def booked_intervals(librarian_ids, start, end):
+    """{librarian_id: IntervalSet} of non-cancelled appointments overlapping [start, end), one query."""
+    busy = {l: IntervalSet() for l in librarian_ids}
+    for a in (
+        db.session.query(Appointment.librarian_user_id, Appointment.start_datetime, Appointment.end_datetime)
+        .filter(Appointment.librarian_user_id.in_(list(librarian_ids)),
+                Appointment.start_datetime < end, Appointment.end_datetime > start,
+                Appointment.status != 'cancelled')
+    ):
+        busy[a.librarian_user_id].add(a.start_datetime, a.end_datetime)
+    return busy
+
 # 11. Create Appointment
 @app.route('/appointments', methods=['POST'])
 def create_appointment():
@@ -1098,22 +3104,18 @@ def create_appointment():
     
     if end <= start:
         return jsonify({'error': 'End time must be after start time'}), 400
-    
+
+    # Must fall inside opening hours, when the library has any configured
+    hours = library_hours(data['library_id'])
+    if hours and not opening_intervals(hours, start.date() - timedelta(days=1), end.date()).contains(start, end):
+        return jsonify({'error': 'Library is closed at that time'}), 400
+
     # Check for conflicts
-    conflict = Appointment.query.filter(
-        Appointment.librarian_user_id == librarian.user_id,
-        or_(
-            and_(Appointment.start_datetime <= start, Appointment.end_datetime > start),
-            and_(Appointment.start_datetime < end, Appointment.end_datetime >= end),
-            and_(Appointment.start_datetime >= start, Appointment.end_datetime <= end)
-        )
-    ).first()
-    
-    if conflict:
+    if booked_intervals([librarian.user_id], start, end)[librarian.user_id].overlaps(start, end):
         return jsonify({'error': 'Time slot not available'}), 409
     
     appointment = Appointment(
-        user_id=request.current_user.user_id,
+        user_id=g.current_user.user_id,
         librarian_user_id=librarian.user_id,
         library_id=data['library_id'],
         start_datetime=start,
@@ -1130,6 +3132,48 @@ def create_appointment():
         'start': appointment.start_datetime.isoformat()
     }), 201
 
+# Free appointment windows per librarian: opening hours minus booked appointments.
+# ?from=&to= (dates, default the next 7 days), ?librarian_id=1,2 (default all staff),
+# ?duration=minutes (only windows at least this long, default 30)
+@app.route('/libraries/<int:library_id>/appointments/free', methods=['GET'])
+def appointment_free_slots(library_id):
+    try:
+        first, last = date_range_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    first = first or date.today()
+    last = last or first + timedelta(days=6)
+    if first > last or (last - first).days >= APPOINTMENT_SLOT_MAX_DAYS:
+        return jsonify({'error': f'Range must be between 1 and {APPOINTMENT_SLOT_MAX_DAYS} days'}), 400
+    duration = timedelta(minutes=max(request.args.get('duration', 30, type=int), 1))
+
+    raw_ids = request.args.get('librarian_id')
+    try:
+        wanted = [int(x) for x in raw_ids.split(',') if x.strip()] if raw_ids else None
+    except ValueError:
+        return jsonify({'error': 'librarian_id must be a comma-separated list of ids'}), 400
+    staff = db.session.query(User.user_id, User.name).filter(User.role == 'staff')
+    if wanted is not None:
+        staff = staff.filter(User.user_id.in_(wanted))
+    staff = staff.all()
+
+    start = max(datetime.combine(first, time()), datetime.now().replace(second=0, microsecond=0))
+    end = datetime.combine(last + timedelta(days=1), time())
+    open_hours = opening_intervals(library_hours(library_id), first - timedelta(days=1), last).clip(start, end)
+    busy = booked_intervals([s.user_id for s in staff], start, end)
+
+    return jsonify({
+        'library_id': library_id,
+        'from': first.isoformat(),
+        'to': last.isoformat(),
+        'librarians': [{
+            'librarian_user_id': s.user_id,
+            'name': s.name,
+            'free': [{'start': a.isoformat(), 'end': b.isoformat()}
+                     for a, b in open_hours.subtract(busy[s.user_id]) if b - a >= duration]
+        } for s in staff]
+    })
+
 # 12. Submit Recommendation
 @app.route('/recommendations', methods=['POST'])
 def submit_recommendation():
@@ -1150,9 +3194,11 @@ def submit_recommendation():
 # Get all rooms
 @app.route('/libraries/<int:library_id>/rooms', methods=['GET'])
 def get_rooms(library_id):
-    rooms = Room.query.filter_by(library_id=library_id).all()
-    room_list = [{'room_id': r.room_id, 'name': r.name, 'room_type': r.room_type} for r in rooms]
-    return jsonify({'rooms': room_list})
+    def render():
+        rooms = Room.query.filter_by(library_id=library_id).all()
+        room_list = [{'room_id': r.room_id, 'name': r.name, 'room_type': r.room_type} for r in rooms]
+        return {'rooms': room_list}
+    return cached_json(('rooms', library_id), render)
 
 # Create new room
 @app.route('/libraries/<int:library_id>/rooms', methods=['POST'])
@@ -1165,6 +3211,7 @@ def create_room(library_id):
     )
     db.session.add(new_room)
     db.session.commit()
+    read_cache.bump()
     return jsonify({
     'room_id': new_room.room_id,
     'name': new_room.name,
@@ -1174,19 +3221,14 @@ def create_room(library_id):
 #14 List ALL computers in library ---
 @app.route('/libraries/<int:library_id>/computers', methods=['GET'])
 def list_computers(library_id):
-    comps = (
-        Seat.query
-        .join(Room)
-        .filter(Room.library_id == library_id, Seat.is_computer == True)
-        .all()
-    )
+    comps = fresh_seat_map(library_id).seats(library_id, is_computer=True, active_only=False)
     return jsonify([{
-        'computer_id': s.seat_id,
-        'identifier':  s.identifier,
-        'specs':       s.specs,
-        'is_active':   s.is_active,
-        'is_occupied': s.is_occupied,
-        'room_id':     s.room_id
+        'computer_id': s['seat_id'],
+        'identifier':  s['identifier'],
+        'specs':       s['specs'],
+        'is_active':   s['is_active'],
+        'is_occupied': s['is_occupied'],
+        'room_id':     s['room_id']
     } for s in comps]), 200
 
 # Update a computer’s details (specs, active, occupied) ---
@@ -1199,6 +3241,7 @@ def update_computer(library_id, computer_id):
     room = Room.query.filter_by(room_id=comp.room_id, library_id=library_id).first()
     if not room:
         abort(404, description="Computer not found in this library")
+    was_occupied = comp.is_occupied
 
     # 2) apply edits
     if 'identifier' in data:
@@ -1210,7 +3253,10 @@ def update_computer(library_id, computer_id):
     if 'is_occupied' in data:
         comp.is_occupied = bool(data['is_occupied'])
 
+    if comp.is_occupied != was_occupied:
+        record_occupancy([(comp.seat_id, comp.room_id, comp.is_occupied, datetime.utcnow())])
     db.session.commit()
+    seat_written(library_id, seat_state(comp))
 
     return jsonify({
         'computer_id': comp.seat_id,
@@ -1246,6 +3292,8 @@ def register_user():
     )
     
     db.session.add(user)
+    db.session.flush()
+    db.session.add(UserCounter(user_id=user.user_id))
     db.session.commit()
     
     return jsonify({
@@ -1261,17 +3309,22 @@ def user_summary(user_id):
     if user_id != g.current_user.firebase_uid and g.current_user.role != 'staff':
         raise Forbidden('Unauthorized access')
 
-    # Count active reservations & loans
-    res_count = Reservation.query \
-                 .filter_by(user_id=g.current_user.user_id, status='active') \
-                 .count()
-    loan_count = Loan.query \
-                   .filter_by(user_id=g.current_user.user_id, returned_date=None) \
-                   .count()
-    # Sum unpaid fees
-    total_fees = db.session.query(func.coalesce(func.sum(FeeFine.amount), 0)) \
-                   .filter_by(user_id=g.current_user.user_id, status='unpaid') \
-                   .scalar()
+    # One primary-key read of the maintained counters
+    counters = db.session.get(UserCounter, g.current_user.user_id)
+    if counters is None:
+        # Users from before the counters table: build their row once
+        res_count, loan_count, total_fees = user_counter_source([g.current_user.user_id]).get(
+            g.current_user.user_id, (0, 0, Decimal('0.00')))
+        try:
+            with db.session.begin_nested():
+                db.session.add(UserCounter(user_id=g.current_user.user_id, active_reservations=res_count,
+                                           open_loans=loan_count, unpaid_fees=total_fees))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+    else:
+        res_count, loan_count, total_fees = (counters.active_reservations, counters.open_loans,
+                                             counters.unpaid_fees)
 
     return jsonify({
       'reservations': res_count,
@@ -1279,15 +3332,29 @@ def user_summary(user_id):
       'fees':         float(total_fees)
     })
 
+@app.route('/auth/token_cache', methods=['GET'])
+def token_cache_stats():
+    if g.current_user.role != 'staff':
+        raise Forbidden('Staff only')
+    return jsonify(token_cache.stats())
+
+@app.route('/read_cache', methods=['GET'])
+def read_cache_stats():
+    if g.current_user.role != 'staff':
+        raise Forbidden('Staff only')
+    return jsonify(read_cache.stats())
+
 @app.route('/libraries', methods=['GET'])
 def all_libraries():
-    libs = Library.query.all()
-    return jsonify([{
-        'library_id': l.library_id,
-        'name':       l.name,
-        'location':   l.location,
-        'type':       l.type,
-    } for l in libs])
+    def render():
+        libs = Library.query.all()
+        return [{
+            'library_id': l.library_id,
+            'name':       l.name,
+            'location':   l.location,
+            'type':       l.type,
+        } for l in libs]
+    return cached_json('libraries', render)
 
 
 
@@ -0,0 +1,91 @@
+"""
+Compiled opening schedules for the "open now / closes at / next opening" endpoint.
+
+A LibrarySchedule holds each weekday's opening intervals as sorted minute offsets
+from that day's midnight (an interval past 1440 runs over midnight) plus per-date
+exceptions that replace a weekday's hours (an empty list means closed all day).
+Lookups bisect one or two days' intervals; nothing touches the database. All times
+are naive local times of the library.
+"""
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# How far ahead next_opening looks before giving up (long closures, no hours at all)
+LOOKAHEAD_DAYS = 400
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def _day_intervals(pairs):
+    """[(open_time, close_time)] -> sorted, merged [(start_min, end_min)]."""
+    spans = []
+    for open_t, close_t in pairs:
+        start, end = _minutes(open_t), _minutes(close_t)
+        if end <= start:
+            end += 1440
+        spans.append((start, end))
+    spans.sort()
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class LibrarySchedule:
+    def __init__(self, weekly, exceptions=None):
+        """weekly: {'Mon': [(open_time, close_time)], ...}; exceptions: {date: [(open_time, close_time)]}."""
+        self._weekly = [_day_intervals(weekly.get(day, ())) for day in WEEKDAYS]
+        self._exceptions = {d: _day_intervals(pairs) for d, pairs in (exceptions or {}).items()}
+
+    def intervals(self, day):
+        spans = self._exceptions.get(day)
+        if spans is None:
+            spans = self._weekly[day.weekday()]
+        return spans
+
+    def _span_at(self, day, minute):
+        spans = self.intervals(day)
+        i = bisect_right(spans, (minute, float('inf'))) - 1
+        if i >= 0 and spans[i][1] > minute:
+            return spans[i]
+        return None
+
+    def _closing(self, day, end):
+        """Follow intervals that start exactly when the previous one ends (e.g. 24h opening)."""
+        close = datetime.combine(day, time()) + timedelta(minutes=end)
+        for _ in range(LOOKAHEAD_DAYS):
+            next_day = close.date()
+            spans = self.intervals(next_day)
+            minute = _minutes(close.time())
+            follow = next((s for s in spans if s[0] == minute and s[1] > minute), None)
+            if follow is None:
+                break
+            close = datetime.combine(next_day, time()) + timedelta(minutes=follow[1])
+        return close
+
+    def status(self, now):
+        """(is_open, closes_at, next_opening) for the naive local datetime `now`."""
+        today = now.date()
+        minute = now.hour * 60 + now.minute + now.second / 60
+        for day, offset in ((today, minute), (today - timedelta(days=1), minute + 1440)):
+            span = self._span_at(day, offset)
+            if span is not None:
+                return True, self._closing(day, span[1]), None
+        return False, None, self.next_opening(now)
+
+    def next_opening(self, now):
+        today = now.date()
+        minute = now.hour * 60 + now.minute + now.second / 60
+        for n in range(LOOKAHEAD_DAYS):
+            day = today + timedelta(days=n)
+            spans = self.intervals(day)
+            i = bisect_right(spans, (minute, float('inf'))) if n == 0 else 0
+            if i < len(spans):
+                return datetime.combine(day, time()) + timedelta(minutes=spans[i][0])
+        return None
@@ -0,0 +1,30 @@
+import base64
+import json
+
+
+def encode_cursor(position):
+    """Opaque, URL-safe cursor for a dict of keyset values."""
+    raw = json.dumps(position, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; an empty cursor means "from the start". Raises ValueError if malformed."""
+    if not cursor:
+        return {}
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Malformed cursor')
+    if not isinstance(position, dict):
+        raise ValueError('Malformed cursor')
+    return position
+
+
+def parse_limit(raw, default=10, maximum=100):
+    try:
+        limit = int(raw) if raw not in (None, '') else default
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return max(1, min(limit, maximum))
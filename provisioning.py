@@ -0,0 +1,160 @@
+"""
+Declarative room/seat provisioning (`flask provision-library`, POST /libraries/<id>/layout).
+
+A layout lists a library's rooms and their seats:
+
+    {"rooms": [
+        {"name": "library-lab01", "type": "computer_lab",
+         "seats": [{"count": 50, "prefix": "Slab", "width": 2, "is_computer": true}]},
+        {"name": "studyarea", "type": "study_room",
+         "seats": [{"identifier": "Window-1"}, {"count": 99, "prefix": "SSlib-"}]}
+    ]}
+
+A seats entry with "count" expands to prefix + start..start+count-1 (zero padded to
+"width"); any other entry is a single seat. Rooms are matched by name and seats by
+identifier within their room, so re-running a layout only inserts what is missing
+and updates what changed. Occupancy is never touched.
+"""
+from sqlalchemy import bindparam, insert, select, update
+
+DEFAULT_SPECS = 'Standard specs'
+MAX_SEATS_PER_ROOM = 10000
+_INSERT_CHUNK = 1000
+
+
+def expand_layout(layout):
+    """Returns [(name, room_type, {identifier: seat})]; raises ValueError on a bad layout."""
+    rooms = (layout or {}).get('rooms')
+    if not isinstance(rooms, list):
+        raise ValueError("Layout needs a 'rooms' list")
+    out, names = [], set()
+    for room in rooms:
+        name, room_type = (room or {}).get('name'), (room or {}).get('type')
+        if not name or not room_type:
+            raise ValueError("Every room needs a 'name' and a 'type'")
+        if name in names:
+            raise ValueError(f"Room '{name}' appears twice")
+        names.add(name)
+
+        seats = {}
+        for entry in room.get('seats') or []:
+            attrs = {k: entry[k] for k in ('is_computer', 'is_active', 'specs') if k in entry}
+            if 'count' in entry:
+                start, width = int(entry.get('start', 1)), int(entry.get('width', 0))
+                idents = [f"{entry.get('prefix', '')}{i:0{width}d}"
+                          for i in range(start, start + int(entry['count']))]
+            elif entry.get('identifier'):
+                idents = [str(entry['identifier'])]
+            else:
+                raise ValueError(f"Seat entries in '{name}' need 'identifier' or 'count'")
+            for ident in idents:
+                if ident in seats:
+                    raise ValueError(f"Seat '{ident}' appears twice in room '{name}'")
+                seats[ident] = attrs
+        if len(seats) > MAX_SEATS_PER_ROOM:
+            raise ValueError(f"Room '{name}' has more than {MAX_SEATS_PER_ROOM} seats")
+        out.append((name, room_type, seats))
+    return out
+
+
+def _seat_row(room_id, ident, attrs):
+    return {
+        'room_id': room_id,
+        'identifier': ident,
+        'is_computer': bool(attrs.get('is_computer', False)),
+        'is_active': bool(attrs.get('is_active', True)),
+        'is_occupied': False,
+        'specs': attrs.get('specs', DEFAULT_SPECS),
+    }
+
+
+def _insert_chunks(conn, table, rows):
+    for i in range(0, len(rows), _INSERT_CHUNK):
+        conn.execute(insert(table).values(rows[i:i + _INSERT_CHUNK]))
+
+
+def provision_library(conn, tables, library_id, layout, prune=False, dry_run=False):
+    """
+    Bring a library's rooms and seats in line with `layout` inside the caller's
+    transaction. `tables` is metadata.tables. With prune, seats that are not in the
+    layout are deactivated (never deleted). Returns a report of the changes; with
+    dry_run nothing is written.
+    """
+    wanted = expand_layout(layout)
+    room, seat = tables['room'], tables['seat']
+
+    rooms = {r.name: r for r in conn.execute(
+        select(room.c.room_id, room.c.name, room.c.room_type).where(room.c.library_id == library_id))}
+    existing = {}
+    if rooms:
+        for s in conn.execute(
+            select(seat.c.seat_id, seat.c.room_id, seat.c.identifier, seat.c.is_computer,
+                   seat.c.is_active, seat.c.specs)
+            .where(seat.c.room_id.in_([r.room_id for r in rooms.values()]))
+            .order_by(seat.c.seat_id)
+        ):
+            existing.setdefault((s.room_id, s.identifier), s)
+
+    new_rooms, retyped, seat_updates = [], [], []
+    new_seats = {}
+    kept = set()
+    for name, room_type, seats in wanted:
+        current = rooms.get(name)
+        if current is None:
+            new_rooms.append({'library_id': library_id, 'name': name, 'room_type': room_type})
+            new_seats[name] = seats
+            continue
+        if current.room_type != room_type:
+            retyped.append({'b_room_id': current.room_id, 'b_room_type': room_type})
+        missing = {}
+        for ident, attrs in seats.items():
+            s = existing.get((current.room_id, ident))
+            if s is None:
+                missing[ident] = attrs
+                continue
+            kept.add(s.seat_id)
+            target = {
+                'b_is_computer': bool(attrs.get('is_computer', False)),
+                'b_is_active': bool(attrs['is_active']) if 'is_active' in attrs else s.is_active,
+                'b_specs': attrs['specs'] if 'specs' in attrs else s.specs,
+            }
+            if tuple(target.values()) != (s.is_computer, s.is_active, s.specs):
+                seat_updates.append({'b_seat_id': s.seat_id, **target})
+        if missing:
+            new_seats[name] = missing
+
+    retired = []
+    if prune:
+        retired = [s.seat_id for s in existing.values() if s.seat_id not in kept and s.is_active]
+
+    report = {
+        'library_id': library_id,
+        'rooms_created': len(new_rooms),
+        'rooms_retyped': len(retyped),
+        'seats_created': sum(len(v) for v in new_seats.values()),
+        'seats_updated': len(seat_updates),
+        'seats_deactivated': len(retired),
+        'dry_run': dry_run,
+    }
+    if dry_run:
+        return report
+
+    if new_rooms:
+        conn.execute(insert(room).values(new_rooms))
+        rooms.update({r.name: r for r in conn.execute(
+            select(room.c.room_id, room.c.name, room.c.room_type)
+            .where(room.c.library_id == library_id, room.c.name.in_([r['name'] for r in new_rooms])))})
+    if retyped:
+        conn.execute(update(room).where(room.c.room_id == bindparam('b_room_id'))
+                     .values(room_type=bindparam('b_room_type')), retyped)
+
+    seat_rows = [_seat_row(rooms[name].room_id, ident, attrs)
+                 for name, seats in new_seats.items() for ident, attrs in seats.items()]
+    _insert_chunks(conn, seat, seat_rows)
+    if seat_updates:
+        conn.execute(update(seat).where(seat.c.seat_id == bindparam('b_seat_id'))
+                     .values(is_computer=bindparam('b_is_computer'), is_active=bindparam('b_is_active'),
+                             specs=bindparam('b_specs')), seat_updates)
+    if retired:
+        conn.execute(update(seat).where(seat.c.seat_id.in_(retired)).values(is_active=False))
+    return report
@@ -0,0 +1,149 @@
+"""
+EXPLAIN helpers for the hot-query plan check (`flask check-query-plans`).
+
+explain() runs the dialect's EXPLAIN for a SQLAlchemy statement and full_scans()
+reports every table the plan reads with a sequential/full scan. seed_hot_tables()
+fills an empty scratch database with enough rows that planners stop preferring
+sequential scans for small tables.
+"""
+import json
+import random
+from datetime import date, datetime, time, timedelta
+
+_EXPLAIN_PREFIX = {
+    'postgresql': 'EXPLAIN (FORMAT JSON) ',
+    'sqlite':     'EXPLAIN QUERY PLAN ',
+    'mysql':      'EXPLAIN ',
+}
+
+
+def supported(dialect_name):
+    return dialect_name in _EXPLAIN_PREFIX
+
+
+def explain(conn, stmt):
+    dialect = conn.dialect
+    compiled = stmt.compile(dialect=dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql(_EXPLAIN_PREFIX[dialect.name] + str(compiled), params).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def full_scans(dialect_name, plan_rows):
+    """Names of tables read by a sequential/full scan in the given EXPLAIN output."""
+    if dialect_name == 'postgresql':
+        plan = plan_rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        found = []
+
+        def walk(node):
+            if node.get('Node Type') == 'Seq Scan':
+                found.append(node.get('Relation Name'))
+            for child in node.get('Plans', ()):
+                walk(child)
+        for entry in plan:
+            walk(entry['Plan'])
+        return found
+
+    if dialect_name == 'sqlite':
+        # (id, parent, notused, detail): "SCAN t" is a full scan, "SCAN t USING ... INDEX" is not
+        found = []
+        for row in plan_rows:
+            detail = row[-1]
+            if detail.startswith('SCAN ') and 'INDEX' not in detail:
+                found.append(detail.split()[1])
+        return found
+
+    if dialect_name == 'mysql':
+        # columns: id, select_type, table, partitions, type, ...
+        return [row[2] for row in plan_rows if row[4] == 'ALL']
+
+    raise ValueError(f'EXPLAIN not supported for {dialect_name}')
+
+
+def _chunks(rows, size=5000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_hot_tables(conn, tables, n, library_id, echo=print):
+    """
+    Insert roughly n rows into each hot table. `tables` is metadata.tables.
+    Refuses unless user, book, loan and reservation are all empty, so it can only
+    ever run against a scratch database.
+    """
+    for name in ('user', 'book', 'loan', 'reservation', 'seat', 'feefine'):
+        if conn.execute(tables[name].select().limit(1)).first() is not None:
+            raise RuntimeError(f"Table '{name}' is not empty; seeding only runs on a scratch database")
+
+    rnd = random.Random(42)
+    n_users = max(n // 50, 10)
+    n_books = max(n // 50, 10)
+    n_rooms = max(n // 500, 5)
+    today = date.today()
+
+    def insert(name, rows):
+        for batch in _chunks(rows):
+            conn.execute(tables[name].insert(), batch)
+        echo(f'seeded {name}')
+
+    n_libraries = max(n // 1000, 2)
+    insert('library', ({'name': f'Seed library {i}', 'location': 'seed', 'type': 'Information Center'}
+                       for i in range(n_libraries)))
+    lib_ids = [r[0] for r in conn.execute(tables['library'].select().with_only_columns(
+        tables['library'].c.library_id))]
+
+    insert('user', ({'firebase_uid': f'seed-uid-{i}', 'name': f'Seed {i}',
+                     'email': f'seed-{i}@example.invalid', 'role': 'student'} for i in range(n_users)))
+    insert('book', ({'isbn': f'seed-{i}', 'title': f'Seed book {i}', 'author': 'Seed',
+                     'copies_total': 5, 'copies_available': 5} for i in range(n_books)))
+    insert('room', ({'library_id': library_id, 'name': f'seed-room-{i}', 'room_type': 'study_room'}
+                    for i in range(n_rooms)))
+    insert('study_room', ({'name': f'Seed study room {i}', 'capacity': 10, 'is_active': True}
+                          for i in range(n_rooms)))
+
+    user_ids = [r[0] for r in conn.execute(tables['user'].select().with_only_columns(tables['user'].c.user_id))]
+    book_ids = [r[0] for r in conn.execute(tables['book'].select().with_only_columns(tables['book'].c.book_id))]
+    room_ids = [r[0] for r in conn.execute(tables['room'].select().with_only_columns(tables['room'].c.room_id))]
+    study_ids = [r[0] for r in conn.execute(
+        tables['study_room'].select().with_only_columns(tables['study_room'].c.room_id))]
+
+    insert('seat', ({'room_id': rnd.choice(room_ids), 'identifier': f'S{i}',
+                     'is_computer': rnd.random() < 0.3, 'is_active': rnd.random() < 0.9,
+                     'is_occupied': rnd.random() < 0.5} for i in range(n)))
+    now = datetime.utcnow()
+    insert('reservation', ({'user_id': rnd.choice(user_ids), 'book_id': rnd.choice(book_ids),
+                            'library_id': library_id,
+                            'reserved_from': now - timedelta(days=rnd.randint(0, 365)),
+                            'reserved_until': now - timedelta(days=rnd.randint(-1, 365)),
+                            'status': 'active' if rnd.random() < 0.02 else rnd.choice(['cancelled', 'fulfilled'])}
+                           for _ in range(n)))
+    insert('loan', ({'user_id': rnd.choice(user_ids), 'book_id': rnd.choice(book_ids),
+                     'checkout_date': today - timedelta(days=rnd.randint(0, 365)),
+                     'due_date': today - timedelta(days=rnd.randint(-5, 360)),
+                     'returned_date': None if rnd.random() < 0.03 else today - timedelta(days=rnd.randint(0, 360))}
+                    for _ in range(n)))
+    insert('feefine', ({'user_id': rnd.choice(user_ids), 'amount': 5,
+                        'status': 'unpaid' if rnd.random() < 0.05 else 'paid', 'created_at': now}
+                       for _ in range(n)))
+    insert('study_room_member', ({'room_id': rnd.choice(study_ids), 'user_id': rnd.choice(user_ids),
+                                  'status': rnd.choice(['pending', 'approved', 'rejected'])}
+                                 for _ in range(n)))
+    weekdays = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+    insert('operatingtime', ({'library_id': lib, 'weekday': day, 'open_time': time(8), 'close_time': time(20)}
+                             for lib in lib_ids for day in weekdays))
+
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('ANALYZE')
+    elif conn.dialect.name in ('sqlite', 'mysql'):
+        conn.exec_driver_sql('ANALYZE' if conn.dialect.name == 'sqlite' else
+                             'ANALYZE TABLE reservation, loan, feefine, seat, study_room_member, operatingtime')
@@ -0,0 +1,55 @@
+import hashlib
+import threading
+import time
+
+
+class VersionedCache:
+    """
+    Process-local cache of rendered response bodies, all tied to one version counter.
+
+    Writers call bump() after committing; every entry rendered under an older version
+    is then ignored. Entries also expire after `ttl` seconds, which bounds how long a
+    worker can serve data changed through another worker. The ETag is a digest of the
+    body, computed once per version, so all workers agree on it for the same content.
+    At most `max_entries` bodies are kept; the oldest goes first, since keys can come
+    from query strings.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get(self, key, render):
+        """Returns (body, etag), calling render() -> str only when the cached entry is stale."""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == self.version and now - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[2], entry[3]
+
+        self.misses += 1
+        version = self.version
+        body = render()
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:20]
+        with self._lock:
+            # A write landed while rendering: serve this body but don't keep it
+            if self.version == version:
+                self._entries.pop(key, None)
+                while len(self._entries) >= self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+                self._entries[key] = (version, now, body, etag)
+        return body, etag
+
+    def stats(self):
+        return {'version': self.version, 'entries': len(self._entries),
+                'hits': self.hits, 'misses': self.misses}
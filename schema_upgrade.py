@@ -0,0 +1,46 @@
+"""
+Additive schema migrations for deployments that predate a model change.
+
+db.create_all() only creates missing tables; this also adds missing columns and
+indexes declared on the models. It never drops or alters existing objects, so it is
+safe to re-run on every deploy.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+
+def _add_column_sql(table, column, dialect):
+    col_type = column.type.compile(dialect=dialect)
+    # New columns are always added NULLable; existing rows have no value for them
+    return f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'
+
+
+def upgrade_schema(engine, metadata, echo=print):
+    """Returns the list of DDL statements that were applied."""
+    applied = []
+    metadata.create_all(engine)
+    inspector = inspect(engine)
+    dialect = engine.dialect
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    sql = _add_column_sql(table, column, dialect)
+                    conn.exec_driver_sql(sql)
+                    applied.append(sql)
+
+    for table in metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspect(engine).get_indexes(table.name)}
+        existing |= {uc['name'] for uc in inspect(engine).get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            with engine.begin() as conn:
+                conn.execute(CreateIndex(index))
+            applied.append(str(CreateIndex(index).compile(dialect=dialect)).strip())
+
+    for sql in applied:
+        echo(sql)
+    return applied
@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+# Field weights used for ranking; an exact token match scores the full weight,
+# a prefix match half of it
+FIELD_WEIGHTS = {'isbn': 5.0, 'title': 3.0, 'author': 2.0}
+PREFIX_FACTOR = 0.5
+
+_TOKEN_RE = re.compile(r'[^\W_]+')
+_ISBN_CHARS_RE = re.compile(r'^[0-9Xx\s-]+$')
+_ISBN_KEY = '#'
+
+
+def normalize_isbn(raw):
+    """Strip separators and map ISBN-10 to its ISBN-13 form; anything else is returned uppercased."""
+    s = re.sub(r'[\s-]', '', raw or '').upper()
+    if len(s) == 10 and s[:9].isdigit() and (s[9].isdigit() or s[9] == 'X'):
+        core = '978' + s[:9]
+        total = sum((1 if i % 2 == 0 else 3) * int(d) for i, d in enumerate(core))
+        return core + str((10 - total % 10) % 10)
+    return s
+
+
+def tokenize(text):
+    if not text:
+        return []
+    folded = unicodedata.normalize('NFKD', text)
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch))
+    return _TOKEN_RE.findall(folded.lower())
+
+
+class SearchIndex:
+    """
+    In-process inverted index over book isbn/title/author.
+    Terms are kept in a sorted list so prefix lookups are a bisect plus a short scan.
+    """
+
+    def __init__(self):
+        self._postings = {}     # term -> {book_id: weight}
+        self._terms = []        # sorted vocabulary
+        self._doc_terms = {}    # book_id -> set(terms)
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def is_stale(self, max_age):
+        if self.built_at is None:
+            return True
+        return bool(max_age) and time.time() - self.built_at > max_age
+
+    def invalidate(self):
+        # Next is_stale() check triggers a full rebuild (used after bulk writes)
+        self.built_at = None
+
+    def rebuild(self, rows):
+        """rows: iterable of (book_id, isbn, title, author)."""
+        postings, doc_terms = {}, {}
+        for book_id, isbn, title, author in rows:
+            terms = self._terms_for(isbn, title, author)
+            doc_terms[book_id] = set(terms)
+            for term, weight in terms.items():
+                postings.setdefault(term, {})[book_id] = weight
+        with self._lock:
+            self._postings = postings
+            self._doc_terms = doc_terms
+            self._terms = sorted(postings)
+            self.built_at = time.time()
+
+    def add(self, book_id, isbn, title, author):
+        terms = self._terms_for(isbn, title, author)
+        with self._lock:
+            self._remove(book_id)
+            self._doc_terms[book_id] = set(terms)
+            for term, weight in terms.items():
+                docs = self._postings.get(term)
+                if docs is None:
+                    docs = self._postings[term] = {}
+                    insort(self._terms, term)
+                docs[book_id] = weight
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def search(self, query):
+        """Return matching book_ids, best first. Every query token has to match."""
+        return [d for d, _ in self.search_scored(query)]
+
+    def search_scored(self, query):
+        """Like search(), as (book_id, score) pairs ordered by (-score, book_id)."""
+        with self._lock:
+            scores = self._scores(query)
+        return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+    def _scores(self, query):
+        # ISBN-like queries ('1984', '0-306-40615') can also be titles, so both
+        # lookups run and a book keeps the better of its two scores
+        scores = self._isbn_matches(query) or {}
+        tokens = tokenize(query)
+        if not tokens:
+            return scores
+        matched = None
+        for token in tokens:
+            token_scores = self._token_scores(token)
+            if matched is None:
+                matched = token_scores
+            else:
+                matched = {d: s + token_scores[d] for d, s in matched.items() if d in token_scores}
+            if not matched:
+                return scores
+        for d, s in matched.items():
+            if s > scores.get(d, 0):
+                scores[d] = s
+        return scores
+
+    def _isbn_matches(self, query):
+        # Queries made only of ISBN characters with at least a few digits are looked up as ISBNs
+        if not _ISBN_CHARS_RE.match(query) or sum(ch.isdigit() for ch in query) < 4:
+            return None
+        q = normalize_isbn(query)
+        scores = {}
+        for prefix in {q, '978' + q}:
+            for term, docs in self._prefix_range(_ISBN_KEY + prefix):
+                exact = term == _ISBN_KEY + q
+                for d, w in docs.items():
+                    s = w if exact else w * PREFIX_FACTOR
+                    if s > scores.get(d, 0):
+                        scores[d] = s
+        return scores
+
+    def _token_scores(self, token):
+        scores = {}
+        for term, docs in self._prefix_range(token):
+            factor = 1.0 if term == token else PREFIX_FACTOR
+            for d, w in docs.items():
+                s = w * factor
+                if s > scores.get(d, 0):
+                    scores[d] = s
+        return scores
+
+    def _prefix_range(self, prefix):
+        i = bisect_left(self._terms, prefix)
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            term = self._terms[i]
+            yield term, self._postings[term]
+            i += 1
+
+    def _remove(self, book_id):
+        for term in self._doc_terms.pop(book_id, ()):
+            docs = self._postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(book_id, None)
+            if not docs:
+                del self._postings[term]
+                i = bisect_left(self._terms, term)
+                if i < len(self._terms) and self._terms[i] == term:
+                    del self._terms[i]
+
+    @staticmethod
+    def _terms_for(isbn, title, author):
+        terms = {}
+        for field, text in (('title', title), ('author', author)):
+            for token in tokenize(text):
+                terms[token] = max(terms.get(token, 0), FIELD_WEIGHTS[field])
+        if isbn:
+            raw = re.sub(r'[\s-]', '', isbn).upper()
+            for form in {raw, normalize_isbn(isbn)}:
+                terms[_ISBN_KEY + form] = FIELD_WEIGHTS['isbn']
+        return terms
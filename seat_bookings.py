@@ -0,0 +1,67 @@
+"""
+Per-seat interval index over upcoming seat bookings.
+
+Bookings on one seat never overlap, so each seat keeps them sorted by start in two
+parallel lists and an overlap test is one bisect: the only booking that can overlap
+[start, end) is the last one starting before `end`. The index is a cache of the
+seat_booking table; the database check in the booking endpoint stays authoritative.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+
+class BookingIndex:
+    def __init__(self):
+        self._starts = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def __len__(self):
+        return sum(len(v) for v in self._entries.values())
+
+    def is_stale(self, max_age):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    def load(self, rows):
+        """rows: (booking_id, seat_id, start_at, end_at) of active bookings."""
+        starts, entries = {}, {}
+        for booking_id, seat_id, start, end in sorted(rows, key=lambda r: (r[1], r[2])):
+            starts.setdefault(seat_id, []).append(start)
+            entries.setdefault(seat_id, []).append((start, end, booking_id))
+        with self._lock:
+            self._starts, self._entries = starts, entries
+            self.loaded_at = time.monotonic()
+
+    def add(self, seat_id, booking_id, start, end):
+        with self._lock:
+            entries = self._entries.setdefault(seat_id, [])
+            if any(e[2] == booking_id for e in entries):
+                return
+            insort(entries, (start, end, booking_id))
+            self._starts[seat_id] = [e[0] for e in entries]
+
+    def remove(self, seat_id, booking_id):
+        with self._lock:
+            entries = [e for e in self._entries.get(seat_id, ()) if e[2] != booking_id]
+            self._entries[seat_id] = entries
+            self._starts[seat_id] = [e[0] for e in entries]
+
+    def conflicts(self, seat_id, start, end):
+        """Booking ids on the seat overlapping [start, end)."""
+        with self._lock:
+            starts = self._starts.get(seat_id)
+            if not starts:
+                return []
+            entries = self._entries[seat_id]
+            found = []
+            i = bisect_left(starts, end) - 1
+            # Walks back past more than one entry only if the table holds overlapping bookings
+            while i >= 0 and entries[i][1] > start:
+                found.append(entries[i][2])
+                i -= 1
+            return found
+
+    def is_free(self, seat_id, start, end):
+        return not self.conflicts(seat_id, start, end)
@@ -0,0 +1,135 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class Subscriber:
+    def __init__(self, maxsize, epoch):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.epoch = epoch
+        self.dropped = False
+
+
+class _Channel:
+    def __init__(self, seats):
+        self.seats = {s['seat_id']: s for s in seats}
+        # Sequence numbers restart with every channel (and differ between workers), so
+        # event ids carry the channel's epoch too
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.backlog = deque()
+        self.subscribers = set()
+        self.synced_at = time.monotonic()
+
+
+class SeatEventHub:
+    """
+    Per-library seat state with fan-out to stream subscribers.
+
+    Each library channel holds the current seat snapshot, a sequence number and a short
+    backlog of recent deltas, so a reconnecting client (Last-Event-ID) gets only what it
+    missed, as long as the id comes from the same channel (its epoch matches). Publishing is one dict update plus a put per subscriber queue; subscribers
+    never hit the database. `loader(library_id)` -> [seat dict] is called once when a
+    channel opens and then every `resync_interval` seconds while it has subscribers,
+    which picks up writes made by other worker processes.
+    """
+
+    def __init__(self, loader, resync_interval=5.0, backlog=1000, queue_size=1000):
+        self.loader = loader
+        self.resync_interval = resync_interval
+        self.backlog_size = backlog
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, library_id, seat):
+        with self._lock:
+            channel = self._channels.get(library_id)
+            # Nobody is watching this library; the next subscriber loads a fresh snapshot
+            if channel is None:
+                return
+            self._apply(channel, seat)
+
+    def subscribe(self, library_id, last_event_id=None):
+        """
+        Returns (subscriber, initial events). Events are (seq, kind, payload);
+        `last_event_id` is the raw Last-Event-ID, see format_sse().
+        """
+        with self._lock:
+            channel = self._channels.get(library_id)
+        if channel is None:
+            seats = self.loader(library_id)
+            with self._lock:
+                channel = self._channels.setdefault(library_id, _Channel(seats))
+
+        last_seq = parse_event_id(last_event_id, channel.epoch)
+        sub = Subscriber(self.queue_size, channel.epoch)
+        with self._lock:
+            backlog = channel.backlog
+            if (last_seq is not None and backlog
+                    and backlog[0][0] <= last_seq + 1 and last_seq <= channel.seq):
+                initial = [ev for ev in backlog if ev[0] > last_seq]
+            elif last_seq is not None and last_seq == channel.seq:
+                initial = []
+            else:
+                initial = [(channel.seq, 'snapshot', list(channel.seats.values()))]
+            channel.subscribers.add(sub)
+        return sub, initial
+
+    def unsubscribe(self, library_id, sub):
+        with self._lock:
+            channel = self._channels.get(library_id)
+            if channel is None:
+                return
+            channel.subscribers.discard(sub)
+            if not channel.subscribers:
+                del self._channels[library_id]
+
+    def maybe_resync(self, library_id):
+        with self._lock:
+            channel = self._channels.get(library_id)
+            if channel is None or time.monotonic() - channel.synced_at < self.resync_interval:
+                return
+            # claim the resync so concurrent subscribers don't all reload
+            channel.synced_at = time.monotonic()
+        seats = self.loader(library_id)
+        with self._lock:
+            for seat in seats:
+                self._apply(channel, seat)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(c.subscribers) for c in self._channels.values())
+
+    def _apply(self, channel, seat):
+        if channel.seats.get(seat['seat_id']) == seat:
+            return
+        channel.seats[seat['seat_id']] = seat
+        channel.seq += 1
+        event = (channel.seq, 'seat', seat)
+        channel.backlog.append(event)
+        if len(channel.backlog) > self.backlog_size:
+            channel.backlog.popleft()
+        for sub in list(channel.subscribers):
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # Too slow to keep up: cut it loose, it resumes from a snapshot on reconnect
+                sub.dropped = True
+                channel.subscribers.discard(sub)
+
+
+def parse_event_id(raw, epoch):
+    """The seq of an '<epoch>.<seq>' event id from channel `epoch`, else None."""
+    event_epoch, _, seq = (raw or '').partition('.')
+    if event_epoch != epoch or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+def format_sse(event, epoch):
+    seq, kind, payload = event
+    return f'id: {epoch}.{seq}\nevent: {kind}\ndata: {json.dumps(payload, separators=(",", ":"))}\n\n'
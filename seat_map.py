@@ -0,0 +1,221 @@
+"""
+In-memory seat occupancy, one set of bitmasks per room.
+
+Each room gives its seats a position; bit `pos` of the room's `active`, `occupied`,
+`computer` and `present` masks holds that seat's flags. Free counts are a couple of
+bitwise ops and a popcount, with no database round trip. The map is loaded from the
+seat table once and then kept current write-through by the seat endpoints; readers
+re-read a library with load_library() once is_stale() says its rows are too old
+(other processes write seats too). diff() compares it against fresh DB rows for the
+consistency check.
+"""
+import threading
+import time
+from array import array
+
+# seat_id -> room_id << _POS_BITS | pos, one int per seat instead of a tuple
+_POS_BITS = 24
+_POS_MASK = (1 << _POS_BITS) - 1
+
+
+class _Room:
+    __slots__ = ('library_id', 'name', 'seat_ids', 'identifiers', 'specs', 'present', 'active',
+                 'occupied', 'computer', 'holes')
+
+    def __init__(self, library_id, name=None):
+        self.library_id = library_id
+        self.name = name
+        self.seat_ids = array('q')
+        self.identifiers = []
+        self.specs = []
+        self.present = self.active = self.occupied = self.computer = 0
+        self.holes = []
+
+    def free_mask(self, is_computer=None):
+        mask = self.present & self.active & ~self.occupied
+        if is_computer is not None:
+            mask &= self.computer if is_computer else ~self.computer
+        return mask
+
+
+def _bits(mask):
+    pos = 0
+    while mask:
+        if mask & 1:
+            yield pos
+        mask >>= 1
+        pos += 1
+
+
+class SeatMap:
+    """`rows` for load()/diff() are seat dicts as produced by the seat endpoints."""
+
+    def __init__(self):
+        self._rooms = {}
+        self._where = {}
+        self._lock = threading.RLock()
+        self._read_at = {}      # library_id (None: every library) -> monotonic time of the last DB read
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._where)
+
+    def load(self, rows):
+        with self._lock:
+            self._rooms = {}
+            self._where = {}
+            for row in rows:
+                self._put(row['library_id'], row)
+            self._read_at = {None: time.monotonic()}
+            self.loaded = True
+
+    def load_library(self, library_id, rows):
+        """Replace one library's seats with `rows`."""
+        with self._lock:
+            seen = set()
+            for row in rows:
+                self._put(library_id, row)
+                seen.add(row['seat_id'])
+            for _, room in self._rooms_for(library_id):
+                for pos in _bits(room.present):
+                    if room.seat_ids[pos] not in seen:
+                        self._drop(room.seat_ids[pos])
+            self._read_at[library_id] = time.monotonic()
+
+    def is_stale(self, library_id, max_age):
+        """True if `library_id` (None: all of them) was last read from the DB over `max_age` seconds ago."""
+        read_at = self._read_at.get(None, 0)
+        if library_id is not None:
+            read_at = max(read_at, self._read_at.get(library_id, 0))
+        return time.monotonic() - read_at > max_age
+
+    def put(self, library_id, seat):
+        with self._lock:
+            self._put(library_id, seat)
+
+    def _put(self, library_id, seat):
+        seat_id = seat['seat_id']
+        where = self._where.get(seat_id)
+        if where is not None and where >> _POS_BITS != seat['room_id']:
+            self._drop(seat_id)
+            where = None
+
+        room = self._rooms.get(seat['room_id'])
+        if room is None:
+            room = self._rooms[seat['room_id']] = _Room(library_id, seat.get('room_name'))
+        if where is None:
+            if room.holes:
+                pos = room.holes.pop()
+                room.seat_ids[pos] = seat_id
+                room.identifiers[pos] = seat['identifier']
+                room.specs[pos] = seat.get('specs')
+            else:
+                pos = len(room.seat_ids)
+                room.seat_ids.append(seat_id)
+                room.identifiers.append(seat['identifier'])
+                room.specs.append(seat.get('specs'))
+            self._where[seat_id] = seat['room_id'] << _POS_BITS | pos
+        else:
+            pos = where & _POS_MASK
+            room.identifiers[pos] = seat['identifier']
+            room.specs[pos] = seat.get('specs')
+
+        bit = 1 << pos
+        room.present |= bit
+        room.active = room.active | bit if seat['is_active'] else room.active & ~bit
+        room.occupied = room.occupied | bit if seat['is_occupied'] else room.occupied & ~bit
+        room.computer = room.computer | bit if seat['is_computer'] else room.computer & ~bit
+
+    def _drop(self, seat_id):
+        where = self._where.pop(seat_id)
+        room = self._rooms[where >> _POS_BITS]
+        pos = where & _POS_MASK
+        bit = 1 << pos
+        room.present &= ~bit
+        room.active &= ~bit
+        room.occupied &= ~bit
+        room.computer &= ~bit
+        room.identifiers[pos] = room.specs[pos] = None
+        room.holes.append(pos)
+
+    def _rooms_for(self, library_id, room_id=None):
+        if room_id is not None:
+            room = self._rooms.get(room_id)
+            return [(room_id, room)] if room is not None and room.library_id == library_id else []
+        return [(rid, r) for rid, r in self._rooms.items() if r.library_id == library_id]
+
+    def seats(self, library_id, room_id=None, is_computer=None, active_only=True):
+        out = []
+        with self._lock:
+            for rid, room in self._rooms_for(library_id, room_id):
+                mask = room.present & room.active if active_only else room.present
+                if is_computer is not None:
+                    mask &= room.computer if is_computer else ~room.computer
+                for pos in _bits(mask):
+                    bit = 1 << pos
+                    out.append({
+                        'seat_id': room.seat_ids[pos],
+                        'identifier': room.identifiers[pos],
+                        'is_computer': bool(room.computer & bit),
+                        'is_active': bool(room.active & bit),
+                        'is_occupied': bool(room.occupied & bit),
+                        'room_id': rid,
+                        'specs': room.specs[pos],
+                    })
+        return out
+
+    def free_count(self, library_id, room_id=None, is_computer=None):
+        """Active, unoccupied seats."""
+        with self._lock:
+            return sum(room.free_mask(is_computer).bit_count()
+                       for _, room in self._rooms_for(library_id, room_id))
+
+    def summary(self, library_id=None):
+        """Per-room counts (total, active, occupied, free, computers, computers_free) and per-library sums."""
+        libraries = {}
+        with self._lock:
+            for rid, room in self._rooms.items():
+                if library_id is not None and room.library_id != library_id:
+                    continue
+                free = room.free_mask()
+                counts = {
+                    'total': room.present.bit_count(),
+                    'active': (room.present & room.active).bit_count(),
+                    'occupied': (room.present & room.occupied).bit_count(),
+                    'free': free.bit_count(),
+                    'computers': (room.present & room.computer).bit_count(),
+                    'computers_free': (free & room.computer).bit_count(),
+                }
+                lib = libraries.setdefault(room.library_id, {
+                    'library_id': room.library_id, **dict.fromkeys(counts, 0), 'rooms': []})
+                for k, v in counts.items():
+                    lib[k] += v
+                lib['rooms'].append({'room_id': rid, 'name': room.name, **counts})
+        for lib in libraries.values():
+            lib['rooms'].sort(key=lambda r: r['room_id'])
+        return [libraries[k] for k in sorted(libraries)]
+
+    def diff(self, rows):
+        """Seat ids whose DB row (from `rows`) disagrees with the map, plus seats only in the map."""
+        with self._lock:
+            seen = set()
+            mismatched = []
+            for row in rows:
+                seat_id = row['seat_id']
+                seen.add(seat_id)
+                where = self._where.get(seat_id)
+                if where is None or where >> _POS_BITS != row['room_id']:
+                    mismatched.append(seat_id)
+                    continue
+                room = self._rooms[row['room_id']]
+                pos = where & _POS_MASK
+                bit = 1 << pos
+                if (room.library_id != row['library_id']
+                        or room.identifiers[pos] != row['identifier']
+                        or room.specs[pos] != row.get('specs')
+                        or bool(room.active & bit) != bool(row['is_active'])
+                        or bool(room.occupied & bit) != bool(row['is_occupied'])
+                        or bool(room.computer & bit) != bool(row['is_computer'])):
+                    mismatched.append(seat_id)
+            mismatched.extend(seat_id for seat_id in self._where if seat_id not in seen)
+            return mismatched
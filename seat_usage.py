@@ -0,0 +1,162 @@
+"""
+Seat utilisation history (`flask rollup-seat-usage`, GET /libraries/<id>/seats/usage).
+
+Occupancy changes are appended to seat_transition as they happen. rollup() turns
+complete hours of transitions into one seat_usage row per room and hour (seats,
+occupied seconds, transitions), carrying each seat's state across hours in
+seat_usage_state. downsample() merges hourly rows older than the hourly retention
+into daily rows and drops raw transitions that are both rolled up and older than
+the raw retention. A year is then rooms x 8760 hourly rows at most, read with one
+indexed range query.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, delete, func, insert, select
+
+HOUR = timedelta(hours=1)
+_INSERT_CHUNK = 1000
+
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _insert_chunks(conn, table, rows):
+    for i in range(0, len(rows), _INSERT_CHUNK):
+        conn.execute(insert(table).values(rows[i:i + _INSERT_CHUNK]))
+
+
+def _watermark(conn, tables):
+    """Start of the first hour not rolled up yet, or None when there is nothing to do."""
+    usage, transition = tables['seat_usage'], tables['seat_transition']
+    last = conn.execute(select(func.max(usage.c.bucket_start)).where(usage.c.period == 'hour')).scalar()
+    if last is not None:
+        return last + HOUR
+    last = conn.execute(select(func.max(usage.c.bucket_start)).where(usage.c.period == 'day')).scalar()
+    if last is not None:
+        return last + timedelta(days=1)
+    first = conn.execute(select(func.min(transition.c.at))).scalar()
+    return floor_hour(first) if first is not None else None
+
+
+def rollup(conn, tables, now, lag=timedelta(minutes=10), max_hours=24 * 7):
+    """
+    Roll up complete hours ending at least `lag` before `now` (naive UTC), at most
+    `max_hours` per call, in the caller's transaction. Returns the hours rolled up.
+    """
+    usage, state, transition = tables['seat_usage'], tables['seat_usage_state'], tables['seat_transition']
+    room, seat = tables['room'], tables['seat']
+    start = _watermark(conn, tables)
+    if start is None:
+        return 0
+    end = min(floor_hour(now - lag), start + max_hours * HOUR)
+    if end <= start:
+        return 0
+
+    seats = {r.seat_id: [r.room_id, r.is_occupied, r.since] for r in conn.execute(select(state))}
+    occupied = defaultdict(float)
+    changes = defaultdict(int)
+
+    def add(room_id, since, until):
+        t = max(since, start)
+        while t < until:
+            bucket = floor_hour(t)
+            step = min(bucket + HOUR, until)
+            occupied[room_id, bucket] += (step - t).total_seconds()
+            t = step
+
+    for t in conn.execute(
+        select(transition.c.seat_id, transition.c.room_id, transition.c.at, transition.c.is_occupied)
+        .where(transition.c.at >= start, transition.c.at < end)
+        .order_by(transition.c.at, transition.c.transition_id)
+    ):
+        prev = seats.get(t.seat_id)
+        if prev is not None and prev[1]:
+            add(prev[0], prev[2], t.at)
+        # A seat's first transition counts only if it starts out occupied
+        if (prev[1] if prev is not None else False) != t.is_occupied:
+            changes[t.room_id, floor_hour(t.at)] += 1
+        seats[t.seat_id] = [t.room_id, t.is_occupied, t.at]
+    for room_id, is_occupied, since in seats.values():
+        if is_occupied:
+            add(room_id, since, end)
+
+    # Seat counts are sampled now; every room gets a row per hour so the watermark advances
+    rooms = conn.execute(
+        select(room.c.room_id, room.c.library_id,
+               func.coalesce(func.sum(case((seat.c.is_active == True, 1), else_=0)), 0).label('seats'))
+        .select_from(room.outerjoin(seat, seat.c.room_id == room.c.room_id))
+        .group_by(room.c.room_id, room.c.library_id)
+    ).all()
+    rows = []
+    hour = start
+    while hour < end:
+        for r in rooms:
+            rows.append({
+                'room_id': r.room_id, 'library_id': r.library_id, 'period': 'hour', 'bucket_start': hour,
+                'seats': int(r.seats), 'occupied_seconds': int(round(occupied.get((r.room_id, hour), 0))),
+                'transitions': changes.get((r.room_id, hour), 0),
+            })
+        hour += HOUR
+    if not rows:
+        # No rooms at all: nothing to anchor the watermark on
+        return 0
+    _insert_chunks(conn, usage, rows)
+
+    conn.execute(delete(state))
+    _insert_chunks(conn, state, [{'seat_id': k, 'room_id': v[0], 'is_occupied': v[1], 'since': v[2]}
+                                 for k, v in seats.items()])
+    return int((end - start) / HOUR)
+
+
+def downsample(conn, tables, now, hourly_days=400, raw_days=14):
+    """Apply the retention policy; returns (hourly rows merged into days, transitions deleted)."""
+    usage, transition = tables['seat_usage'], tables['seat_transition']
+    cutoff = datetime.combine((now - timedelta(days=hourly_days)).date(), datetime.min.time())
+
+    days = {}
+    old = usage.c.period == 'hour', usage.c.bucket_start < cutoff
+    merged = 0
+    for r in conn.execute(select(usage).where(*old)):
+        key = (r.room_id, r.bucket_start.date())
+        day = days.setdefault(key, {
+            'room_id': r.room_id, 'library_id': r.library_id, 'period': 'day',
+            'bucket_start': datetime.combine(key[1], datetime.min.time()),
+            'seats': 0, 'occupied_seconds': 0, 'transitions': 0})
+        day['seats'] = max(day['seats'], r.seats)
+        day['occupied_seconds'] += r.occupied_seconds
+        day['transitions'] += r.transitions
+        merged += 1
+    if days:
+        _insert_chunks(conn, usage, list(days.values()))
+        conn.execute(delete(usage).where(*old))
+
+    watermark = _watermark(conn, tables)
+    raw_cutoff = now - timedelta(days=raw_days)
+    if watermark is not None and watermark < raw_cutoff:
+        raw_cutoff = watermark
+    removed = conn.execute(delete(transition).where(transition.c.at < raw_cutoff)).rowcount
+    return merged, removed
+
+
+def usage_series(conn, tables, library_id, start, end, room_id=None):
+    """Hourly (or, past the hourly retention, daily) buckets in [start, end), summed over rooms."""
+    usage = tables['seat_usage']
+    conds = [usage.c.library_id == library_id, usage.c.bucket_start >= start, usage.c.bucket_start < end]
+    if room_id is not None:
+        conds.append(usage.c.room_id == room_id)
+    return conn.execute(
+        select(usage.c.period, usage.c.bucket_start,
+               func.sum(usage.c.seats).label('seats'),
+               func.sum(usage.c.occupied_seconds).label('occupied_seconds'),
+               func.sum(usage.c.transitions).label('transitions'))
+        .where(and_(*conds))
+        .group_by(usage.c.period, usage.c.bucket_start)
+        .order_by(usage.c.bucket_start)
+    ).all()
+
+
+def utilisation(seats, occupied_seconds, period):
+    capacity = seats * (3600 if period == 'hour' else 86400)
+    return round(occupied_seconds / capacity, 4) if capacity else None
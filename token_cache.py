@@ -0,0 +1,89 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# What authenticate_request puts on g.current_user, whether it came from the cache or the DB
+AuthUser = namedtuple('AuthUser', ['user_id', 'firebase_uid', 'role', 'name'])
+
+_Entry = namedtuple('_Entry', ['claims', 'user', 'expires_at'])
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified Firebase ID tokens.
+    Keys are sha256 digests of the bearer token so raw tokens never sit in memory,
+    and each entry dies at the token's own `exp` claim.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_uid = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self.key_for(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token, claims, user):
+        expires_at = claims.get('exp')
+        if not expires_at or expires_at <= time.time():
+            return
+        key = self.key_for(token)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(claims, user, expires_at)
+            self._keys_by_uid.setdefault(user.firebase_uid, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_uid(self, firebase_uid):
+        with self._lock:
+            for key in list(self._keys_by_uid.get(firebase_uid, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_uid.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size':     len(self._entries),
+                'maxsize':  self.maxsize,
+                'hits':     self.hits,
+                'misses':   self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        uid = entry.user.firebase_uid
+        keys = self._keys_by_uid.get(uid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_uid[uid]